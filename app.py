@@ -1,295 +1,362 @@
+import hmac
+import os
+
 import dash
+import flask
 import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output
+from dash.dependencies import ClientsideFunction, Input, Output, State
 import numpy as np
-import pandas as pd
-from sklearn import preprocessing
-import plotly.graph_objs as go
-import plotly.express as px
-from plotly.subplots import make_subplots
-from plotly import tools
-
-
-
-######################################################Data##############################################################
 
-path = 'https://raw.githubusercontent.com/MartaFaria/DV_Project_Migration/master/'
+import compression
+import downsample
+import export
+import figures
+import indexes
+import memo
+import metrics
+import serving
+import snapshot
+import warmcache
 
-df = pd.read_excel(path + 'Migration_In_Out.xlsx')
-df_ind = pd.read_excel(path + 'Migration_Indicators.xlsx')
 
 
+######################################################Data##############################################################
 
-###################################################Data Pre-processing###################################################
-sum_mig = df.groupby(['Country', 'Year']).sum().reset_index() #reset_index is used to keep the original columns Country and Year
+# the bundled workbooks are parsed once into a columnar cache (see data.py), later starts memory-map it;
+# everything derived from them (the sum_mig aggregate with its normalized columns, the sparse flow tensor
+# behind the text boxes and the top origins bars, and the indicator cubes) lives in one snapshot (see snapshot.py) that a refresh replaces
+# as a whole. Callbacks read `snapshots.current` once per request.
 
-x = sum_mig[['Inflow', 'Outflow', 'Net-Migration']].values #returns a numpy array
-min_max_scaler = preprocessing.MinMaxScaler()
-x_scaled = min_max_scaler.fit_transform(x)
-df_scaled = pd.DataFrame(x_scaled)
+# number of origins in the inflow/outflow bars
+top_n = int(os.environ.get('MIGRATION_TOP_N', 10))
 
-sum_mig = pd.concat([sum_mig, df_scaled], axis=1)
-sum_mig = sum_mig.rename(columns={0:'norm Inflow', 1:'norm Outflow', 2:'norm Net'})
+# with MIGRATION_POOL_WORKERS set the choropleth builds (the only CPU-heavy ones, over a second each) run in a
+# process pool of that size, so a worker's other threads keep answering the lookups meanwhile
+build_pool = None
+if os.environ.get('MIGRATION_POOL_WORKERS'):
+    build_pool = serving.BuildPool(int(os.environ['MIGRATION_POOL_WORKERS']), initializer=figures.import_plotly)
 
+# with MIGRATION_WARM_CACHE set (a directory) the snapshot, figure templates and choropleths are read from the warm
+# cache written by an earlier start for the same data and code (see warmcache.py)
+snapshots = snapshot.SnapshotStore(pool=build_pool, warm_cache=warmcache.cache_from_env())
 
-df_avg = df_ind.groupby('Year').mean().reset_index()
+# the long-range chart sends at most range_points points per line (about the chart's width in pixels), downsampled
+# with range_method ('lttb' or 'minmax', see downsample.py)
+range_points = int(os.environ.get('MIGRATION_RANGE_POINTS', 1000))
+range_method = os.environ.get('MIGRATION_RANGE_METHOD', 'lttb')
 
 
 ######################################################Interactive Components############################################
 
-country_options = [dict(label=country, value=country) for country in df_ind['Country'].unique()]
-
 mig_options = [
     {'label': 'Net-Migration', 'value': 'norm Net'},
     {'label': 'Migration Inflow', 'value': 'norm Inflow'},
     {'label': 'Migration Outflow', 'value': 'norm Outflow'}
 ]
 
-year_options =[dict(label=Year, value=Year) for Year in df_ind['Year'].unique()]
+# how many arcs the corridor map draws (the largest option also caps what a posted value can ask for)
+corridor_options = [{'label': str(n) + ' corridors', 'value': n} for n in (10, 25, 50, 100, 250)]
+
+# the comparison mode shows up to compare_limit countries side by side (longer selections are cut)
+compare_limit = 20
+compare_default = ['Portugal', 'Spain', 'France', 'Germany', 'Italy']
+
+def dropdown_compare(snap):
+    return dcc.Dropdown(
+        id='compare_drop',
+        options=[{'label': i, 'value': i} for i in snap.countries
+                 ],
+        value=[c for c in compare_default if c in snap.countries],
+        multi=True,
+        placeholder='Select up to ' + str(compare_limit) + ' countries to compare'
+    )
+
+indicator_options = [{'label': title.replace('<br>', ''), 'value': i} for i, (_, title, _, _) in enumerate(figures.INDICATORS)]
+
+def range_slider(snap):
+    first_year, last_year = snap.years[0], snap.years[-1]
+    return dcc.RangeSlider(
+        id='range_slider',
+        min=first_year,
+        max=last_year,
+        marks={i: '{}'.format(i) for i in range(first_year, last_year + 1)},
+        value=[first_year, last_year],
+        step=1,
+        allowCross=False
+    )
 
-dropdown_country = dcc.Dropdown(
-    id='country_drop',
-    options=[{'label': i, 'value': i} for i in df_ind['Country'].unique()
-             ],
-    value='Afghanistan',
-    clearable=False
-)
+def dropdown_country(snap):
+    return dcc.Dropdown(
+        id='country_drop',
+        options=[{'label': i, 'value': i} for i in snap.countries
+                 ],
+        value='Afghanistan',
+        clearable=False
+    )
 
 
 
 ##################################################APP###############################################################
 
-app = dash.Dash(__name__)
+# responses are compressed by compression.py (brotli or gzip, compressed callback responses cached)
+app = dash.Dash(__name__, compress=False)
 server = app.server
+compression.compress_responses(server, version=lambda: snapshots.current.version,
+                               cache_size=int(os.environ.get('MIGRATION_COMPRESSED_CACHE_SIZE', 256)))
 
 
-app.layout = html.Div([
+# the layout is built per page load, so the dropdown and the slider follow the current snapshot
+def serve_layout():
+    snap = snapshots.current
+    first_year, last_year = snap.years[0], snap.years[-1]
 
-    html.Div([
-        html.H1(
-            'GLOBAL MIGRATION PATTERNS',
-            style={'width': '100%', 'display': 'inline-block', 'height': '50px', 'font-family':'sans-serif',
-                   'color':'#155724', 'text-align': 'center','vertical-align': 'top', 'padding': '0px'},
-        ),
+    layout = html.Div([
+
+        html.Div([
+            html.H1(
+                'GLOBAL MIGRATION PATTERNS',
+                style={'width': '100%', 'display': 'inline-block', 'height': '50px', 'font-family':'sans-serif',
+                       'color':'#155724', 'text-align': 'center','vertical-align': 'top', 'padding': '0px'},
+            ),
+
+            html.H2(
+                "An Overview",
+                style={'width': '100%', 'display': 'inline-block', 'position': 'relative','height': '5px',
+                       'color' : '#155724', 'font-family':'sans-serif', 'text-align': 'center','vertical-align': 'top', 'padding': '0px'}
+            ),
+        ]),
+
+        html.Div([],style = {'width': '100%','backgroundColor':'#f2f2f2','padding':15, 'margin-bottom':0}),
+
+        html.Div([
+            html.Div([dcc.Markdown('### MIGRATION AROUND THE WORLD'
+                                   '\n\nMigration refers to the movement of people from place to place. People migrate for many different reasons, which can be classified as *economic*, *social*, *political* or *environmental*.'
+                                   '\n\n* **Economic migration** is related to finding work or better economic opportunities. '
+                                   '\n\n* **Social migration** refers to the search of a better quality of life or to be closer to family and friends.'
+                                   '\n\n* **Political migration** occurs when people is moving to escape conflict, political persecution, terrorism, or human rights violations. '
+                                   '\n\n* **Environmental** causes of migration include the adverse effects of climate change, natural disasters, and other environmental factors. '
+                                   '\n\nOver the last years, migration has become a key issue for countries all over the world. More people than ever live in a country other than the one in which they were born.' 
+                                   '\n\nTherefore, as a group, we thought that it would be interesting to explore migration patterns and their underlying causes.')
+                      ], style={'width': '40%', 'text-align': 'justify', 'font-family':'sans-serif', 'font-size':'15px',
+                                'position': 'relative', 'color': '#111', 'background-color':'#fffff'},
+                     className='box'),
+
+            html.Div([
+                html.Div([dcc.RadioItems(id='mig_radio',
+                                         options=mig_options,
+                                         value='norm Net',
+                                         labelStyle={'display': 'inline'})
+                          ], style={'width': '100%', 'color': '#111', 'background-color': '#fffff', 'border-radius': '5px',
+                                    'text-align':'center', 'font-family':'sans-serif'}
+                         ),
+
+                html.Div([dcc.Graph(id='choropleth_graph')
+                          ], style={'width': '100%','color': '#111', 'background-color': '#fffff', 'border-radius': '5px',
+                                    'font-family':'sans-serif','vertical-align': 'middle'}
+                         ),
+
+            ], style = {'width': '60%'},
+            className='box')
+        ], style = {'display': 'flex'}),
+
+        html.Div([
+
+            html.Div([
+                html.Div([
+                    html.Label('Select country'),
+                    dropdown_country(snap)],
+                    style={'width': '100%', 'text-align': 'justify', 'horizontal-align': 'left', 'vertical-align': 'middle',
+                           'margin-left': '10%', 'margin-right': '20%', 'font-family':'sans-serif', 'font-size':14, 'color':'#111'}),
+
+                html.Br(),
+                html.Br(),
+
+                html.Div([
+                    html.Label('Select year'),
+                    dcc.Slider(
+                        id='year_slider',
+                        min=first_year,
+                        max=last_year,
+                        marks={i: '{}'.format(i) for i in range(first_year, last_year)},
+                        value=last_year,
+                        step=1,
+                        included=False
+                    )], style={'width': '100%', 'text-align': 'justify', 'font-family':'sans-serif', 'font-size': 14,
+                               'vertical-align': 'middle', 'horizontal-align': 'left', 'margin-left': '10%', 'margin-right': '10%',
+                               'color':'#111'}),
+            ], style={'width': '40%'}),
+
+            html.Div([
+                html.Div([
+                    html.Div([html.Div([html.H4("The selected country and year are:")],
+                                       style={"font-size": 15, 'font-family':'sans-serif', 'horizontal-align': 'middle', 'color': '#111'}),
+                              dcc.Loading(html.Div([html.H4("...")], id="box-country",
+                                                   style={"font-size": 19, 'font-family':'sans-serif', 'color': '#155724',
+                                                          "font-weight": "bold", 'horizontal-align': 'middle'}))],
+                             ),
+                ], style={'margin-right': '5%', 'width': '100%', 'text-align': 'center', 'backgroundColor': '#fff',
+                          'vertical-align': 'center', 'horizontal-align': 'middle', 'font-family':'sans-serif'}),
+
+                html.Div([
+                    html.Div([html.Div([html.H4("Total number of migrants entering the country (Inflow)")],
+                                       style={"font-size": 15, 'font-family':'sans-serif', 'horizontal-align': 'middle', 'color': '#111'}),
+                              dcc.Loading(html.Div([html.H4("")], id="box-inflow",
+                                                   style={"font-size": 19, "font-weight": "bold",'vertical-align': 'middle', 'color': '#155724',
+                                                          'horizontal-align': 'middle', 'font-family':'sans-serif',}))],
+                             ),
+                ], style={'margin-right': '5%', 'width': '100%', 'text-align': 'center', 'backgroundColor': '#fff',
+                          'vertical-align': 'middle', 'horizontal-align': 'middle', 'font-family':'sans-serif',}),
+
+                html.Div([
+                    html.Div([html.Div([html.H4("Total number of migrants leaving the country (Outflow)")],
+                                       style={"font-size": 15, 'font-family':'sans-serif', 'horizontal-align': 'middle', 'color': '#111'}),
+                              dcc.Loading(html.Div([html.H4("")], id="box-outflow",
+                                                   style={"font-size": 19, "font-weight": "bold", 'color': '#155724','font-family':'sans-serif',
+                                                          'vertical-align': 'middle', 'horizontal-align': 'middle'}))]
+                             ),
+                ], style={'margin-right': '5%', 'width': '100%', 'text-align': 'center', 'backgroundColor': '#fff',
+                          'vertical-align': 'middle', 'horizontal-align': 'middle'}),
+
+                html.Div([
+                    html.Div([html.Div([html.H4("")], style={"font-size": 15, 'font-family':'sans-serif', 'horizontal-align': 'middle', 'color': '#111'}),
+                              dcc.Loading(html.Div([html.H4("")], id="box-net",
+                                                   style={'width': '100%', 'font-family':'sans-serif', "font-size": 15,
+                                                          "font-weight": "bold",'color': '#111'}))]
+                             ),
+                ], style={'margin-right': '5%', 'width': '100%', 'text-align': 'center', 'backgroundColor': '#fff',
+                          'vertical-align': 'center', 'horizontal-align': 'middle'}),
+
+
+            ], style={'display': 'flex', 'width': '60%', 'text-align': 'center', 'vertical-align': 'middle',
+                      'margin-left': '10%', 'backgroundColor': '#fff'}),
+        ], style={'display': 'flex', 'margin-left': '2%', 'margin-right': '2%',
+                  'margin': '10px', 'padding': '15px', 'position': 'relative','font-family': 'sans-serif'}, className='box'),
 
-        html.H2(
-            "An Overview",
-            style={'width': '100%', 'display': 'inline-block', 'position': 'relative','height': '5px',
-                   'color' : '#155724', 'font-family':'sans-serif', 'text-align': 'center','vertical-align': 'top', 'padding': '0px'}
+        html.Div([
+            html.Br(),
+            html.Div([dcc.Graph(id='hbar2')], style={'flex': '33%'}),
+            html.Div([dcc.Graph(id='hbar1')], style={'flex': '33%'}),
+            html.Div([dcc.Graph(id='line')], style={'flex': '33%'})
+        ],
+            style={'display': 'flex', 'color': '#111','font-family': 'sans-serif'},
+            className='box'
         ),
-    ]),
-
-    html.Div([],style = {'width': '100%','backgroundColor':'#f2f2f2','padding':15, 'margin-bottom':0}),
-
-    html.Div([
-        html.Div([dcc.Markdown('### MIGRATION AROUND THE WORLD'
-                               '\n\nMigration refers to the movement of people from place to place. People migrate for many different reasons, which can be classified as *economic*, *social*, *political* or *environmental*.'
-                               '\n\n* **Economic migration** is related to finding work or better economic opportunities. '
-                               '\n\n* **Social migration** refers to the search of a better quality of life or to be closer to family and friends.'
-                               '\n\n* **Political migration** occurs when people is moving to escape conflict, political persecution, terrorism, or human rights violations. '
-                               '\n\n* **Environmental** causes of migration include the adverse effects of climate change, natural disasters, and other environmental factors. '
-                               '\n\nOver the last years, migration has become a key issue for countries all over the world. More people than ever live in a country other than the one in which they were born.' 
-                               '\n\nTherefore, as a group, we thought that it would be interesting to explore migration patterns and their underlying causes.')
-                  ], style={'width': '40%', 'text-align': 'justify', 'font-family':'sans-serif', 'font-size':'15px',
-                            'position': 'relative', 'color': '#111', 'background-color':'#fffff'},
-                 className='box'),
 
         html.Div([
-            html.Div([dcc.RadioItems(id='mig_radio',
-                                     options=mig_options,
-                                     value='norm Net',
+            html.Div([html.Label('Select a range of years'),
+                      range_slider(snap),
+                      dcc.RadioItems(id='range_indicator',
+                                     options=indicator_options,
+                                     value=0,
+                                     labelStyle={'display': 'inline'})
+                      ], style={'width': '100%', 'color': '#111', 'text-align':'center', 'font-family':'sans-serif'}
+                     ),
+            html.Div([dcc.Graph(id='range_line')], style={'width': '100%'}),
+        ], style={'color': '#111', 'font-family': 'sans-serif'}, className='box'),
+
+        html.Div([
+            html.Div([dcc.RadioItems(id='corridor_count',
+                                     options=corridor_options,
+                                     value=50,
                                      labelStyle={'display': 'inline'})
                       ], style={'width': '100%', 'color': '#111', 'background-color': '#fffff', 'border-radius': '5px',
                                 'text-align':'center', 'font-family':'sans-serif'}
                      ),
 
-            html.Div([dcc.Graph(id='choropleth_graph')
+            html.Div([dcc.Graph(id='corridor_graph')
                       ], style={'width': '100%','color': '#111', 'background-color': '#fffff', 'border-radius': '5px',
                                 'font-family':'sans-serif','vertical-align': 'middle'}
                      ),
-
-        ], style = {'width': '60%'},
-        className='box')
-    ], style = {'display': 'flex'}),
-
-    html.Div([
+        ], className='box'),
 
         html.Div([
-            html.Div([
-                html.Label('Select country'),
-                dropdown_country],
-                style={'width': '100%', 'text-align': 'justify', 'horizontal-align': 'left', 'vertical-align': 'middle',
-                       'margin-left': '10%', 'margin-right': '20%', 'font-family':'sans-serif', 'font-size':14, 'color':'#111'}),
-
-            html.Br(),
             html.Br(),
-
-            html.Div([
-                html.Label('Select year'),
-                dcc.Slider(
-                    id='year_slider',
-                    min=2008,
-                    max=2017,
-                    marks={i: '{}'.format(i) for i in range(2008, 2017)},
-                    value=2017,
-                    step=1,
-                    included=False
-                )], style={'width': '100%', 'text-align': 'justify', 'font-family':'sans-serif', 'font-size': 14,
-                           'vertical-align': 'middle', 'horizontal-align': 'left', 'margin-left': '10%', 'margin-right': '10%',
-                           'color':'#111'}),
-        ], style={'width': '40%'}),
+            html.Div([dcc.Graph(id='bar1')], style={'flex': '35%'}),
+            html.Div([dcc.Graph(id='bar2')], style={'flex': '35%'}),
+            html.Div([dcc.Graph(id='bar3')], style={'flex': '35%'}),
+            html.Div([dcc.Graph(id='bar4')], style={'flex': '35%'})
+        ],
+            style={'display':'flex','color': '#111', 'font-family': 'sans-serif'},
+            className='box'
+        ),
 
         html.Div([
+            html.Div([dcc.Markdown('#### Compare countries'),
+                      dropdown_compare(snap)
+                      ], style={'width': '100%', 'color': '#111', 'font-family':'sans-serif'}
+                     ),
+            html.Div([dcc.Graph(id='compare_line')], style={'width': '100%'}),
             html.Div([
-                html.Div([html.Div([html.H4("The selected country and year are:")],
-                                   style={"font-size": 15, 'font-family':'sans-serif', 'horizontal-align': 'middle', 'color': '#111'}),
-                          dcc.Loading(html.Div([html.H4("...")], id="box-country",
-                                               style={"font-size": 19, 'font-family':'sans-serif', 'color': '#155724',
-                                                      "font-weight": "bold", 'horizontal-align': 'middle'}))],
-                         ),
-            ], style={'margin-right': '5%', 'width': '100%', 'text-align': 'center', 'backgroundColor': '#fff',
-                      'vertical-align': 'center', 'horizontal-align': 'middle', 'font-family':'sans-serif'}),
-
-            html.Div([
-                html.Div([html.Div([html.H4("Total number of migrants entering the country (Inflow)")],
-                                   style={"font-size": 15, 'font-family':'sans-serif', 'horizontal-align': 'middle', 'color': '#111'}),
-                          dcc.Loading(html.Div([html.H4("")], id="box-inflow",
-                                               style={"font-size": 19, "font-weight": "bold",'vertical-align': 'middle', 'color': '#155724',
-                                                      'horizontal-align': 'middle', 'font-family':'sans-serif',}))],
-                         ),
-            ], style={'margin-right': '5%', 'width': '100%', 'text-align': 'center', 'backgroundColor': '#fff',
-                      'vertical-align': 'middle', 'horizontal-align': 'middle', 'font-family':'sans-serif',}),
+                html.Div([dcc.Graph(id='compare_bar1')], style={'flex': '35%'}),
+                html.Div([dcc.Graph(id='compare_bar2')], style={'flex': '35%'}),
+                html.Div([dcc.Graph(id='compare_bar3')], style={'flex': '35%'}),
+                html.Div([dcc.Graph(id='compare_bar4')], style={'flex': '35%'})
+            ], style={'display':'flex'}),
+        ], style={'color': '#111', 'font-family': 'sans-serif'}, className='box'),
 
-            html.Div([
-                html.Div([html.Div([html.H4("Total number of migrants leaving the country (Outflow)")],
-                                   style={"font-size": 15, 'font-family':'sans-serif', 'horizontal-align': 'middle', 'color': '#111'}),
-                          dcc.Loading(html.Div([html.H4("")], id="box-outflow",
-                                               style={"font-size": 19, "font-weight": "bold", 'color': '#155724','font-family':'sans-serif',
-                                                      'vertical-align': 'middle', 'horizontal-align': 'middle'}))]
-                         ),
-            ], style={'margin-right': '5%', 'width': '100%', 'text-align': 'center', 'backgroundColor': '#fff',
-                      'vertical-align': 'middle', 'horizontal-align': 'middle'}),
+        html.Div([
+            html.Footer([
+                html.Label(["Data Visualization | June 2020 | Carlos Pereira, M20190426 |"
+                            " Cátia Duro, M20190394 | João Miguel Lopes, M20190465 | Marta Faria, M20190178"]),
 
-            html.Div([
-                html.Div([html.Div([html.H4("")], style={"font-size": 15, 'font-family':'sans-serif', 'horizontal-align': 'middle', 'color': '#111'}),
-                          dcc.Loading(html.Div([html.H4("")], id="box-net",
-                                               style={'width': '100%', 'font-family':'sans-serif', "font-size": 15,
-                                                      "font-weight": "bold",'color': '#111'}))]
-                         ),
-            ], style={'margin-right': '5%', 'width': '100%', 'text-align': 'center', 'backgroundColor': '#fff',
-                      'vertical-align': 'center', 'horizontal-align': 'middle'}),
-
-
-        ], style={'display': 'flex', 'width': '60%', 'text-align': 'center', 'vertical-align': 'middle',
-                  'margin-left': '10%', 'backgroundColor': '#fff'}),
-    ], style={'display': 'flex', 'margin-left': '2%', 'margin-right': '2%',
-              'margin': '10px', 'padding': '15px', 'position': 'relative','font-family': 'sans-serif'}, className='box'),
-
-    html.Div([
-        html.Br(),
-        html.Div([dcc.Graph(id='hbar2')], style={'flex': '33%'}),
-        html.Div([dcc.Graph(id='hbar1')], style={'flex': '33%'}),
-        html.Div([dcc.Graph(id='line')], style={'flex': '33%'})
-    ],
-        style={'display': 'flex', 'color': '#111','font-family': 'sans-serif'},
-        className='box'
-    ),
-
-    html.Div([
-        html.Br(),
-        html.Div([dcc.Graph(id='bar1')], style={'flex': '35%'}),
-        html.Div([dcc.Graph(id='bar2')], style={'flex': '35%'}),
-        html.Div([dcc.Graph(id='bar3')], style={'flex': '35%'}),
-        html.Div([dcc.Graph(id='bar4')], style={'flex': '35%'})
-    ],
-        style={'display':'flex','color': '#111', 'font-family': 'sans-serif'},
-        className='box'
-    ),
-
-    html.Div([
-        html.Footer([
-            html.Label(["Data Visualization | June 2020 | Carlos Pereira, M20190426 |"
-                        " Cátia Duro, M20190394 | João Miguel Lopes, M20190465 | Marta Faria, M20190178"]),
-
-            html.Label([" | Data available at: ",
-                        html.A("OECD",
-                               href="https://www.oecd.org/migration/mig/oecdmigrationdatabases.htm", target="_blank"),
-                        ", ",
-                        html.A("The Global Economy",
-                               href="https://www.theglobaleconomy.com/", target="_blank"),
-                        " and ",
-                        html.A("Our World in Data",
-                               href="https://ourworldindata.org/charts", target="_blank"),
-                        ])],
-                       style ={'width': '100%', 'display': 'inline-block', 'color' : '#111', 'font-family':'sans-serif',
-                               'font-size':'12px', 'text-align': 'center','vertical-align': 'middle', 'font-weight':'bold',
-                               'padding': '5px'}
-       )])],className = 'body', style = {'backgroundColor':'#f2f2f2','padding':15, 'margin-bottom':0})
+                html.Label([" | Data available at: ",
+                            html.A("OECD",
+                                   href="https://www.oecd.org/migration/mig/oecdmigrationdatabases.htm", target="_blank"),
+                            ", ",
+                            html.A("The Global Economy",
+                                   href="https://www.theglobaleconomy.com/", target="_blank"),
+                            " and ",
+                            html.A("Our World in Data",
+                                   href="https://ourworldindata.org/charts", target="_blank"),
+                            ])],
+                           style ={'width': '100%', 'display': 'inline-block', 'color' : '#111', 'font-family':'sans-serif',
+                                   'font-size':'12px', 'text-align': 'center','vertical-align': 'middle', 'font-weight':'bold',
+                                   'padding': '5px'}
+           )])],className = 'body', style = {'backgroundColor':'#f2f2f2','padding':15, 'margin-bottom':0})
 
+    # the summary table behind the clientside text boxes (see MIGRATION_CLIENTSIDE below)
+    if os.environ.get('MIGRATION_CLIENTSIDE'):
+        layout.children.append(dcc.Store(id='summary_store', data=indexes.summary_table(snap.flow_tensor)))
 
-######################################################Callbacks#########################################################
+    return layout
 
-#------------------------------------------------- Text boxs -----------------------------------------------------------
 
-@app.callback(
-    Output('box-country', 'children'),
-    [Input('country_drop', 'value'),
-     Input('year_slider', 'value')
-])
-def update_box_country(countries, selected_year):
-    box_country = countries + ', ' + str(selected_year)
-    return box_country
+app.layout = serve_layout
 
 
-@app.callback(
-    Output('box-inflow', 'children'),
-    [Input('country_drop', 'value'),
-     Input('year_slider', 'value')
-])
-def update_box_inflow(countries, year):
-    df_year = df.loc[df['Year'] == year]
-    df_year_country = df_year.loc[df_year['Country'] == countries]
-    df_year_country_in = df_year_country['Inflow'].sum()
-    box_inflow = str(df_year_country_in)
-    return box_inflow
+######################################################Callbacks#########################################################
 
+#------------------------------------------------- Text boxs -----------------------------------------------------------
 
-@app.callback(
-    Output('box-outflow', 'children'),
-    [Input('country_drop', 'value'),
-     Input('year_slider', 'value')
-])
-def update_box_outflow(countries, year):
-    df_year = df.loc[df['Year'] == year]
-    df_year_country = df_year.loc[df_year['Country'] == countries]
-    df_year_country_out = df_year_country['Outflow'].sum()
-    box_outflow = str(df_year_country_out)
-    return box_outflow
+box_outputs = [Output('box-country', 'children'),
+               Output('box-inflow', 'children'),
+               Output('box-outflow', 'children'),
+               Output('box-net', 'children')
+               ]
 
+def update_boxes(countries, year):
+    with metrics.phase('data'):
+        inflow, outflow, net = snapshots.current.flow_tensor.totals(countries, year)
 
-@app.callback(
-    Output('box-net', 'children'),
-    [Input('country_drop', 'value'),
-     Input('year_slider', 'value')
-])
+    box_country = countries + ', ' + str(year)
+    box_inflow = str(inflow)
+    box_outflow = str(outflow)
 
-def update_box_net(countries, year):
-    df_year = df.loc[df['Year'] == year]
-    df_year_country = df_year.loc[df_year['Country'] == countries]
-    df_year_country_net = df_year_country['Net-Migration'].sum()
-    if df_year_country_net>0:
+    if net>0:
         mig = 'entering'
     else:
         mig = 'leaving'
     box_net = 'In ' + str(year) + ', the migration flows in ' + countries + ' were mainly from people ' + mig + ' the country.'
-    return box_net
+
+    return [box_country, box_inflow, box_outflow, box_net]
 
 
 
 
 #------------------------------------------------------ Choropleth Map --------------------------------------------------
-@app.callback(
+@serving.encoded_callback(
+    app,
     Output('choropleth_graph', 'figure'),
 
     [Input('mig_radio', 'value')
@@ -297,391 +364,285 @@ def update_box_net(countries, year):
 )
 
 def update_graph(migvar):
-    if migvar=='norm Net':
-        new_migvar='Net-Migration'
-        hover_var = 'Net-Migration'
-    elif migvar=='norm Inflow':
-        new_migvar='Migrants Inflow'
-        hover_var='Inflow'
-    else:
-        new_migvar='Migrants Outflow'
-        hover_var='Outflow'
+    return snapshots.current.choropleth.get(migvar)
+
+#------------------------------------------------------ Corridor map ----------------------------------------------------
+# the year's largest corridors (origin -> destination inflows), read from the per year ranking of the snapshot
 
+@serving.encoded_callback(
+    app,
+    [Output('corridor_graph', 'figure')],
 
-    data_choropleth = px.choropleth(sum_mig,
-                                    locations="Country",
-                                    locationmode="country names",
-                                    color=migvar,
-                                    hover_name="Country",
-                                    hover_data=["Year", hover_var],
-                                    color_continuous_scale='YlGn',
-                                    animation_frame="Year",
-                                    projection="natural earth",
-                                    title=dict(text="<b>Global " + str(new_migvar) + '</b>', x=.5, font={"size": 20, 'family':'sans-serif',
-                                                                                             'color':'#111'}),
-                                    labels={migvar:'Number of migrants <br>(min-max normalization)',
-                                                "size": 12, 'family':'sans-serif','color':'#111'})
+    [Input('year_slider', 'value'),
+     Input('corridor_count', 'value')
+     ]
+)
+@serving.encoded
+def update_corridors(year, count):
+    snap = snapshots.current
 
-    fig_choro = go.Figure(data=data_choropleth)
+    with metrics.phase('data'):
+        count = min(int(count), corridor_options[-1]['value'])
+        origins, destinations, values = snap.corridors.top(year, count)
+        origin_names = snap.flow_tensor.origins[origins]
+        destination_names = snap.flow_tensor.destinations[destinations]
 
-    return fig_choro
+    with metrics.phase('figure'):
+        return [figures.corridor_figure(year, count, origin_names, destination_names, snap.origin_lonlat[origins],
+                                        snap.destination_lonlat[destinations], values)]
 
-#--------------------------------------------------- Bar charts ----------------------------------------------------------
-@app.callback(
-    [Output('hbar1', 'figure'),
-     Output('hbar2', 'figure')
-     ],
+#---------------------------------------------------- Long-range chart --------------------------------------------------
+# inflow, outflow and one indicator of the selected country over any range of years, each line downsampled to at
+# most range_points points before it is sent
+
+@serving.encoded_callback(
+    app,
+    [Output('range_line', 'figure')],
 
     [Input('country_drop', 'value'),
-     Input('year_slider', 'value')
+     Input('range_slider', 'value'),
+     Input('range_indicator', 'value')
      ]
 )
+@serving.encoded
+def update_range(countries, years, indicator):
+    snap = snapshots.current
 
-def update_graph(countries, year):
-    df_year = df.loc[df['Year'] == year]
-
-
-    df_year_country = df_year.loc[df_year['Country'] == countries]
-    df_year_country_in = df_year_country.loc[df_year_country['Inflow']>0]
-    top_ten_in = df_year_country_in.sort_values(by=['Inflow'], ascending=False)
-    top_ten_in = top_ten_in.head(10)
-
-    df_year_country_out = df_year_country.loc[df_year_country['Outflow'] > 0]
-    top_ten_out = df_year_country_out.sort_values(by=['Outflow'], ascending=False)
-    top_ten_out = top_ten_out.head(10)
-
-    max_in = top_ten_in['Inflow'].max()
-    max_out = top_ten_out['Outflow'].max()
-    max_in_out = max(max_in, max_out)
-    max_in_out = max_in_out + 500
-
-    trace = go.Bar(
-        x=top_ten_in["Inflow"],
-        y=top_ten_in["Country of origin"],
-        orientation="h",
-        marker=dict(
-            color='rgb(35,132,67)',
-            line=dict(
-                color='rgb(35,132,67)',
-                width=10)
-        ),
-        width=.05
-    )
+    with metrics.phase('data'):
+        first, last = min(years), max(years)
+        indicator = int(indicator) % len(figures.INDICATORS)
+        flow_years, flows = snap.flow_cube.window(countries, first, last)
+        indicator_years, indicators = snap.indicator_cube.window(countries, first, last)
 
-    data_hbar = [trace]
-
-    layout_hbar = dict(title=dict(text="Migration inflow - Top-10 countries<br>" + str(countries) + ", " + str(year),
-                                  x=.5, font={"size": 15, 'family':'sans-serif', 'color':'#111'}),
-                       xaxis=dict(title=dict(text="Number of migrants", font={"size": 13, 'family':'sans-serif', 'color':'#111'}),
-                                  gridcolor="LightGrey",
-                                  showline=True,
-                                  range=[0, max_in_out],
-                                  linecolor="rgb(89, 89, 89)",
-                                  tickfont=dict(family="sans-serif", size=12, color='#111')),
-                       yaxis=dict(tickfont=dict(family="sans-serif", size=12, color='#111'),
-                                  autorange="reversed"),
-                       paper_bgcolor="rgb(0,0,0,0)",
-                       plot_bgcolor="rgb(0,0,0,0)",
-                       )
-
-    trace1 = go.Bar(
-        x=top_ten_out["Outflow"],
-        y=top_ten_out["Country of origin"],
-        orientation="h",
-        marker=dict(
-            color='rgb(203,24,29)',
-            line=dict(
-                color='rgb(203,24,29)',
-                width=10)
-        ),
-        width=.05
-    )
+        inflow = downsample.downsample(flow_years, flows[:, 0], range_points, range_method)
+        outflow = downsample.downsample(flow_years, flows[:, 1], range_points, range_method)
+        values = downsample.downsample(indicator_years, indicators[:, indicator], range_points, range_method)
+
+    with metrics.phase('figure'):
+        return [figures.range_figure(countries, first, last, inflow, outflow, values, indicator)]
+
+#--------------------------------------------------- Bar charts ----------------------------------------------------------
 
-    data_hbar1 = [trace1]
+hbar_outputs = [Output('hbar1', 'figure'),
+                Output('hbar2', 'figure')
+                ]
 
-    layout_hbar1 = dict(title=dict(text="Migration outflow - Top-10 countries<br>"
-                                        + str(countries) + ", " + str(year), x=.5, font={"size": 15, 'family':'sans-serif', 'color':'#111'}),
-                        xaxis=dict(title=dict(text="Number of migrants", font={"size": 13, 'family':'sans-serif', 'color':'#111'}),
-                                   gridcolor="LightGrey",
-                                   showline=True,
-                                   linecolor="rgb(89, 89, 89)",
-                                   range=[max_in_out, 0],
-                                   tickfont=dict(family="sans-serif", size=12, color='#111')),
-                        yaxis=dict(tickfont=dict(family="sans-serif", size=12, color='#111'),
-                                   autorange="reversed"),
-                        paper_bgcolor="rgb(0,0,0,0)",
-                        plot_bgcolor="rgb(0,0,0,0)"
-                        )
+def update_hbars(countries, year):
+    with metrics.phase('data'):
+        flow_tensor = snapshots.current.flow_tensor
+        top_ten_in, in_values = flow_tensor.top(countries, year, 'Inflow', top_n)
+        top_ten_out, out_values = flow_tensor.top(countries, year, 'Outflow', top_n)
 
-    fig_bar = go.Figure(data=data_hbar, layout=layout_hbar)
-    fig_bar1 = go.Figure(data=data_hbar1, layout=layout_hbar1)
+        max_in = in_values.max() if len(in_values) else np.nan
+        max_out = out_values.max() if len(out_values) else np.nan
+        # a side without origins is NaN, the range follows the other one
+        max_in_out = np.fmax(max_in, max_out)
+        max_in_out = max_in_out + 500
 
-    return fig_bar, fig_bar1
+    with metrics.phase('figure'):
+        return list(figures.hbar_figures(countries, year, top_n, top_ten_in, in_values, top_ten_out, out_values, max_in_out))
 
 
 
 
 #--------------------------------------------------- Bar charts ----------------------------------------------------------
-@app.callback(
-    [Output('bar1', 'figure'),
-     Output('bar2', 'figure'),
-     Output('bar3', 'figure'),
-     Output('bar4', 'figure'),
-     Output('line', 'figure')
+
+indicator_outputs = [Output('bar1', 'figure'),
+                     Output('bar2', 'figure'),
+                     Output('bar3', 'figure'),
+                     Output('bar4', 'figure'),
+                     Output('line', 'figure')
+                     ]
+
+def update_indicators(countries, year):
+    snap = snapshots.current
+
+    # a 4 year window ending at `year`, at least 3 years wide at the start of the data
+    first_year = snap.years[0]
+    selected_year = year
+    year_aux = year-3
+    if (year_aux<first_year+2 and year<=first_year+2):
+        year_aux=first_year
+        year = first_year+2
+
+    with metrics.phase('data'):
+        years, indicators = snap.indicator_cube.window(countries, year_aux, year)
+        stats = snap.indicator_stats
+        avg_years, avg_indicators = stats.mean_window(year_aux, year)
+        band_years, band_low, band_high = stats.band(year_aux, year, *figures.BAND)
+        region = stats.region_window(countries, year_aux, year)
+        ranking = stats.ranking(countries, selected_year)
+        flow_years, flows = snap.flow_cube.window(countries, year_aux, year)
+
+        max_in_out = flows.max() if len(flows) else np.nan
+        max_in_out = max_in_out + 100
+
+
+    with metrics.phase('figure'):
+        fig_bars = [figures.indicator_figure(i, years, indicators[:, i], avg_years, avg_indicators[:, i],
+                                             band=(band_years, band_low[:, i], band_high[:, i]),
+                                             region=region and (region[0], region[1], region[2][:, i]),
+                                             rank=ranking and (selected_year, ranking[0][i], ranking[1][i]))
+                    for i in range(len(figures.INDICATORS))]
+
+        fig_line = figures.line_figure(countries, year_aux, year, flow_years, flows[:, 0], flows[:, 1], max_in_out)
+
+    return fig_bars + [fig_line]
+
+
+#------------------------------------------------ (country, year) callbacks ---------------------------------------------
+# By default the text boxes, the top-10 bars and the indicator charts are three callbacks (three requests per
+# interaction). With MIGRATION_BATCHED set they are answered together by one callback, in one request.
+
+selection_inputs = [Input('country_drop', 'value'),
+                    Input('year_slider', 'value')
+                    ]
+
+selection_parts = [(box_outputs, update_boxes),
+                   (hbar_outputs, update_hbars),
+                   (indicator_outputs, update_indicators)]
+
+# With MIGRATION_CLIENTSIDE set the text boxes are rendered in the browser (assets/clientside.js) from a
+# summary table shipped once with the layout, so scrubbing the slider sends no requests for them.
+if os.environ.get('MIGRATION_CLIENTSIDE'):
+    app.clientside_callback(
+        ClientsideFunction(namespace='migration', function_name='update_boxes'),
+        box_outputs,
+        selection_inputs,
+        [State('summary_store', 'data')]
+    )
+    selection_parts = selection_parts[1:]
+
+# the figures are encoded by serving.encode (orjson) instead of dash's json.dumps
+if os.environ.get('MIGRATION_BATCHED'):
+    @serving.encoded_callback(
+        app,
+        [output for outputs, _ in selection_parts for output in outputs],
+        selection_inputs
+    )
+    @serving.encoded
+    def update_selection(countries, year):
+        return [value for _, update in selection_parts for value in update(countries, year)]
+
+else:
+    for outputs, update in selection_parts:
+        serving.encoded_callback(app, outputs, selection_inputs)(serving.encoded(update))
+
+
+
+#------------------------------------------------ Country comparison ----------------------------------------------------
+# every compared country is read in one gather over the cubes (one fancy index for the whole selection, not one
+# lookup per country), so the latency barely moves from 1 to compare_limit countries
+
+@serving.encoded_callback(
+    app,
+    [Output('compare_line', 'figure'),
+     Output('compare_bar1', 'figure'),
+     Output('compare_bar2', 'figure'),
+     Output('compare_bar3', 'figure'),
+     Output('compare_bar4', 'figure')
      ],
 
-    [Input('country_drop', 'value'),
+    [Input('compare_drop', 'value'),
      Input('year_slider', 'value')
      ]
 )
+@serving.encoded
+def update_comparison(countries, year):
+    snap = snapshots.current
 
-def update_graph(countries, year):
-    year_aux = year-3
-    if (year_aux<2010 and year<=2010):
-        year_aux=2008
-        year = 2010
-
-    dff = df_ind[(df_ind['Year'] >= year_aux) & (df_ind['Year'] <= year)]
-    dff_avg = df_avg[(df_avg['Year'] >= year_aux) & (df_avg['Year'] <= year)]
-
-    df_bar = dff.loc[(dff['Country'] == countries)]
-
-    max_in = df_bar['Inflow'].max()
-    max_out = df_bar['Outflow'].max()
-    max_in_out = max(max_in, max_out)
-    max_in_out = max_in_out + 100
-
-
-    data_bar = [
-        go.Bar(
-            x=df_bar['Year'],
-            y=df_bar['Deaths - Conflict and terrorism'],
-            orientation="v",
-            showlegend=False,
-            name='',
-            marker=dict(
-                color='rgb(239,225,156)',
-                line=dict(
-                    color='rgb(217,240,163)',
-                    width=12)
-            ),
-            width=.05
-        ),
-        go.Scatter(
-            x=dff_avg['Year'],
-            y=dff_avg['Deaths - Conflict and terrorism'],
-            showlegend=False,
-            name='',
-            mode='lines',
-            line=dict(color="#000000", width=2)
-    )]
-
-    layout_bar = dict(title=dict(text="Deaths due to <br>conflicts and terrorism",
-                                 x=.5, font={"size": 15, 'family':'sans-serif', 'color': '#111'}),
-                      xaxis=dict(showline=True,
-                                 linecolor="rgb(89, 89, 89)",
-                                 tickmode='linear',
-                                 tickangle=-90,
-                                 tickfont=dict(family="sans-serif", size=12, color='#111')),
-                      yaxis=dict(title=dict(text="Number of deaths per 100000 inhab", font={"size": 13, 'family':'sans-serif', 'color': '#111'}),
-                                 gridcolor="LightGrey",
-                                 range=[0, 765],
-                                 tickfont=dict(family="sans-serif", size=12, color='#111')
-                                 ),
-                      paper_bgcolor="#ffffff",
-                      plot_bgcolor="#ffffff",
-                      barmode='stack'
-                      )
-
-    data_bar2 = [go.Bar(
-        x=df_bar['Year'],
-        y=df_bar['GDP per capita'],
-        orientation="v",
-        showlegend=False,
-        name='',
-        marker=dict(
-            color='rgb(239,225,156)',
-            line=dict(
-                color='rgb(217,240,163)',
-                width=12)
-        ),
-        width=.05
-    ),
-        go.Scatter(
-            x=dff_avg['Year'],
-            y=dff_avg['GDP per capita'],
-            showlegend=False,
-            name='',
-            mode='lines',
-            line=dict(color="#000000", width=2)
-        )
-    ]
-
-    layout_bar2 = dict(title=dict(text="GDP per capita",
-                                  x=.5, font={"size": 15, 'family':'sans-serif', 'color': '#111'}),
-                       xaxis=dict(showline=True,
-                                  linecolor="rgb(89, 89, 89)",
-                                  tickmode='linear',
-                                  tickangle=-90,
-                                  tickfont=dict(family="sans-serif", size=12, color='#111')),
-                       yaxis=dict(title=dict(text="US Dollars", font={"size": 13, 'family':'sans-serif', 'color': '#111'}),
-                                  gridcolor="LightGrey",
-                                  range=[0, 130000],
-                                  tickfont=dict(family="sans-serif", size=12, color='#111')
-                                  ),
-                       paper_bgcolor="#ffffff",
-                       plot_bgcolor="#ffffff",
-                       barmode='stack'
-                       )
-
-    data_bar3 = [go.Bar(
-        x=df_bar['Year'],
-        y=df_bar['Political stability index (-2.5 weak; 2.5 strong)'],
-        orientation="v",
-        showlegend=False,
-        name='',
-        marker=dict(
-            color='rgb(239,225,156)',
-            line=dict(
-                color='rgb(217,240,163)',
-                width=12)
-        ),
-        width=.05
-    ),
-        go.Scatter(
-            x=dff_avg['Year'],
-            y=dff_avg['Political stability index (-2.5 weak; 2.5 strong)'],
-            showlegend=False,
-            name='',
-            mode='lines',
-            line=dict(color="#000000", width=2)
-        )
-    ]
-
-
-    layout_bar3 = dict(title=dict(text="Political stability",
-                                  x=.5, font={"size": 15, 'family':'sans-serif', 'color': '#111'}),
-                       xaxis=dict(showline=True,
-                                  linecolor="rgb(89, 89, 89)",
-                                  tickmode='linear',
-                                  tickangle=-90,
-                                  tickfont=dict(family="sans-serif", size=12, color='#111')),
-                       yaxis=dict(title=dict(text="Stability index (-2.5 weak; 2.5 strong)", font={"size": 13, 'family':'sans-serif', 'color': '#111'}),
-                                  gridcolor="LightGrey",
-                                  range=[-3.5, 2.5],
-                                  tickfont=dict(family="sans-serif", size=12, color='#111'),
-                                  ),
-                       paper_bgcolor="#ffffff",
-                       plot_bgcolor="#ffffff",
-                       barmode='stack'
-                       )
-
-    data_bar4 = [go.Bar(
-        x=df_bar['Year'],
-        y=df_bar['Health spending per capita'],
-        orientation="v",
-        showlegend=False,
-        name='',
-        marker=dict(
-            color='rgb(239,225,156)',
-            line=dict(
-                color='rgb(217,240,163)',
-                width=12)
-        ),
-        width=.05
-    ),
-        go.Scatter(
-            x=dff_avg['Year'],
-            y=dff_avg['Health spending per capita'],
-            name='Global annual average',
-            mode='lines',
-            line=dict(color="#000000", width=2)
-        )
-    ]
-
-    layout_bar4 = dict(title=dict(text='Health spending per capita',
-                                  x=.5, font={"size": 15, 'family':'sans-serif', 'color': '#111'}),
-                       xaxis=dict(showline=True,
-                                  linecolor="rgb(89, 89, 89)",
-                                  tickmode='linear',
-                                  tickangle=-90,
-                                  tickfont=dict(family="sans-serif", size=12, color='#111')),
-                       yaxis=dict(title=dict(text="US Dollars", font={"size": 13, 'family':'sans-serif', 'color': '#111'}),
-                                  gridcolor="LightGrey",
-                                  range=[0, 10250],
-                                  tickfont=dict(family="sans-serif", size=12, color='#111')
-                                  ),
-                       legend=dict(orientation='h',
-                                   yanchor='top',
-                                   xanchor='center',
-                                   y=-0.3,
-                                   x=0.5,
-                                   font=dict(family="sans-serif", size=12, color="#111")
-                                   ),
-                       paper_bgcolor="#ffffff",
-                       plot_bgcolor="#ffffff",
-                       barmode='stack'
-                       )
-
-
-    trace6 = go.Scatter(
-        x=df_bar['Year'],
-        y=df_bar['Inflow'],
-        name='Inflow',
-        mode='lines',
-        line=dict(color="#237924", width=2)
-    )
+    with metrics.phase('data'):
+        countries = list(countries or [])[:compare_limit]
+        flow_countries, flow_years, flows = snap.flow_cube.gather(countries, snap.years[0], snap.years[-1])
+        net = flows[:, :, 0] - flows[:, :, 1]
 
-    trace7 = go.Scatter(
-        x=df_bar['Year'],
-        y=df_bar['Outflow'],
-        name='Outflow',
-        mode='lines',
-        line=dict(color="#cc0000", width=2)
-    )
+        names, _, indicators = snap.indicator_cube.gather(countries, year, year)
+        _, averages = snap.indicator_stats.mean_window(year, year)
+
+    with metrics.phase('figure'):
+        fig_line = figures.compare_line_figure(flow_countries, flow_years, net)
+        # a year outside the data (a stale client after a refresh) has no column to index
+        fig_bars = [figures.compare_bar_figure(i, year, names, indicators[:, 0, i] if indicators.shape[1] else [],
+                                               averages[0, i] if len(averages) else None)
+                    for i in range(len(figures.INDICATORS))]
+
+    return [fig_line] + fig_bars
+
+
+######################################################Memoization#######################################################
+# every (country, year) callback is memoized in an LRU (optionally backed by a store shared by the workers);
+# the keys carry the snapshot version, so a refresh never serves responses computed from older data
+
+memo_cache = memo.cache_from_env()
+memoized_callbacks = memo.memoize_callbacks(app, memo_cache, ['country_drop', 'year_slider'],
+                                            valid_args=lambda: snapshots.current.grid,
+                                            namespace=lambda: snapshots.current.version)
+
+
+@server.route('/_cache-stats')
+def cache_stats():
+    return flask.jsonify(memo_cache.stats())
 
-    data_line = [trace6, trace7]
-
-    layout_line = dict(title=dict(text='Inflow vs Outlow: ' + str(countries) +
-                                       "<br> from " + str(year_aux) + " to " + str(year),
-                                  x=.5,
-                                  font={"size": 15, 'family':'sans-serif', 'color': '#111'}),
-                       xaxis=dict(title=dict(text='Year',font={"size": 13, 'family':'sans-serif', 'color': '#111'}),
-                                  gridcolor="LightGrey",
-                                  range=[year_aux, year],
-                                  showline=True,
-                                  linewidth=1.1,
-                                  linecolor="rgb(89, 89, 89)",
-                                  tickfont=dict(family="sans-serif", size=12, color='#111'),
-                                  tickmode='linear'),
-                       yaxis=dict(title=dict(text="Number of migrants",font={"size": 13, 'family':'sans-serif', 'color': '#111'}),
-                                  gridcolor="LightGrey",
-                                  range=[0, max_in_out],
-                                  tickfont=dict(family="sans-serif", size=12, color='#111')
-                                  ),
-                       legend=dict(orientation='h',
-                                   yanchor='top',
-                                   xanchor='center',
-                                   y=-0.3,
-                                   x=0.5,
-                                   font=dict(family="sans-serif", size=12, color="#111")
-                                   ),
-                       paper_bgcolor = "#ffffff",
-                       plot_bgcolor="#ffffff"
-                       )
-
-
-
-    fig_bar2 = go.Figure(data=data_bar, layout=layout_bar)
-    fig_bar3 = go.Figure(data=data_bar2, layout=layout_bar2)
-    fig_bar4 = go.Figure(data=data_bar3, layout=layout_bar3)
-    fig_bar5 = go.Figure(data=data_bar4, layout=layout_bar4)
-    fig_line = go.Figure(data=data_line, layout=layout_line)
-
-    return fig_bar2,fig_bar3, fig_bar4, fig_bar5, fig_line
+
+# what the validation of the current workbooks found and changed (see validation.py)
+@server.route('/_data-report')
+def data_report():
+    return flask.jsonify(snapshots.report)
+
+
+# zero compute mode: answer the callbacks from an artifact written by export.py (only while the data is the
+# version it was exported from)
+if os.environ.get('MIGRATION_ARTIFACT'):
+    export.serve_from_artifact(app, export.Artifact(os.environ['MIGRATION_ARTIFACT']),
+                               version=lambda: snapshots.current.version)
+elif os.environ.get('MIGRATION_WARMUP'):
+    figures.build_templates()
+    snapshots.current.choropleth.warm(option['value'] for option in mig_options)
+    memo.warm_up(app, memo_cache, memoized_callbacks, sorted(snapshots.current.grid))
+
+
+######################################################Metrics###########################################################
+# With MIGRATION_METRICS set every callback request is timed (total and by phase: data lookups, figure building,
+# JSON serialization, or cache for memo/artifact hits) and sized, exported as Prometheus histograms on /metrics.
+# MIGRATION_PROFILE_SLOW_MS adds a sampling profiler dumping flame graph stacks of the slower requests.
+
+if os.environ.get('MIGRATION_METRICS'):
+    callback_metrics = metrics.CallbackMetrics()
+    metrics.instrument_callbacks(app, callback_metrics, metrics.profiler_from_env())
+
+    @server.route('/metrics')
+    def metrics_endpoint():
+        body, content_type = metrics.metrics_response()
+        return flask.Response(body, content_type=content_type)
+
+
+######################################################Data refresh######################################################
+# New rows in the workbooks are picked up without a restart: POST /_admin/refresh (with MIGRATION_ADMIN_TOKEN
+# as a bearer token) refreshes the worker answering it, MIGRATION_REFRESH_INTERVAL makes every worker poll the
+# files itself.
+
+# responses of the old snapshot can't be hit anymore, free them
+snapshots.listeners.append(lambda old, new: memo_cache.clear())
+
+
+@server.route('/_admin/refresh', methods=['POST'])
+def admin_refresh():
+    token = os.environ.get('MIGRATION_ADMIN_TOKEN')
+    if not token:
+        flask.abort(404)
+    if not hmac.compare_digest(flask.request.headers.get('Authorization', ''), 'Bearer ' + token):
+        flask.abort(403)
+    return flask.jsonify(snapshots.refresh(force=flask.request.args.get('force') == '1'))
+
+
+# seconds between two polls of the workbooks; each gunicorn worker (not the preloading master) starts its own
+# watcher in gunicorn.conf.py's post_fork, the dev server below
+refresh_interval = os.environ.get('MIGRATION_REFRESH_INTERVAL')
+refresh_interval = float(refresh_interval) if refresh_interval else None
 
 
 
 if __name__ == '__main__':
+    if refresh_interval is not None:
+        snapshots.watch(refresh_interval)
     app.run_server(debug=True)
-
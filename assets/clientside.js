@@ -0,0 +1,16 @@
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    migration: {
+        // the KPI text boxes, rendered from the (country, year) summary table shipped once in summary_store
+        update_boxes: function(countries, year, summary) {
+            var row = summary.totals[countries];
+            var i = summary.years.indexOf(year);
+            var totals = (row && i >= 0 && row[i]) || [0, 0, 0];
+            var mig = totals[2] > 0 ? 'entering' : 'leaving';
+
+            return [countries + ', ' + year,
+                    String(totals[0]),
+                    String(totals[1]),
+                    'In ' + year + ', the migration flows in ' + countries + ' were mainly from people ' + mig + ' the country.'];
+        }
+    }
+});
@@ -0,0 +1,45 @@
+# Per-request latency of the KPI text boxes over the full country x year grid:
+# the former three df scans per interaction vs the precomputed (Country, Year) totals.
+#
+#   python benchmarks/bench_boxes.py
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+
+snap = app.snapshots.current
+
+
+def scan_boxes(countries, year):
+    df = snap.df
+    results = []
+    for column in ['Inflow', 'Outflow', 'Net-Migration']:
+        df_year = df.loc[df['Year'] == year]
+        df_year_country = df_year.loc[df_year['Country'] == countries]
+        results.append(df_year_country[column].sum())
+    return results
+
+
+def run(name, func, grid):
+    timings = []
+    for countries, year in grid:
+        start = time.perf_counter()
+        func(countries, year)
+        timings.append(time.perf_counter() - start)
+    timings = np.array(timings) * 1e6
+    print('{:<16} requests={:<6} mean={:9.1f}us p50={:9.1f}us p95={:9.1f}us total={:8.3f}s'.format(
+        name, len(timings), timings.mean(), np.percentile(timings, 50), np.percentile(timings, 95), timings.sum() / 1e6))
+
+
+if __name__ == '__main__':
+    countries = [str(c) for c in snap.df_ind['Country'].unique()]
+    years = sorted(int(y) for y in snap.df_ind['Year'].unique())
+    grid = [(c, y) for c in countries for y in years]
+
+    run('before', scan_boxes, grid)
+    run('after', app.update_boxes, grid)
@@ -0,0 +1,45 @@
+# Per-request latency of the country comparison by number of compared countries: one window lookup per country
+# (how the single country charts read the cubes) vs one gather over the cubes for the whole selection, and the whole
+# callback (gather and figures) with the size of its response.
+#
+#   python benchmarks/bench_compare.py [--sizes 1 5 10 20] [--requests 200]
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+from bench_boxes import run
+
+snap = app.snapshots.current
+
+
+def per_country(countries, year):
+    flows = [snap.flow_cube.window(country, snap.years[0], snap.years[-1]) for country in countries]
+    indicators = [snap.indicator_cube.window(country, year, year) for country in countries]
+    return flows, indicators
+
+
+def gathered(countries, year):
+    return (snap.flow_cube.gather(countries, snap.years[0], snap.years[-1]),
+            snap.indicator_cube.gather(countries, year, year))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 5, 10, 20])
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    update_comparison = app.update_comparison.__wrapped__
+    rng = random.Random(0)
+    for size in args.sizes:
+        grid = [(rng.sample(snap.countries, size), rng.choice(snap.years)) for _ in range(args.requests)]
+        update_comparison(*grid[0])
+
+        print('{} countries, {} bytes'.format(size, sum(len(v) for v in update_comparison(*grid[0]))))
+        run('  per country', per_country, grid)
+        run('  gather', gathered, grid)
+        run('  callback', update_comparison, grid)
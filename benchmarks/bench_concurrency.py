@@ -0,0 +1,129 @@
+# Lookup latency while the choropleths build, per gunicorn setting: starts gunicorn (gunicorn.conf.py) once per
+# configuration, keeps --clients threads posting the text boxes callback (random country and year) and, one second
+# in, requests every map twice at once on the cold server (each build takes over a second). Reports the box latency
+# during the map builds and after them, the box throughput and the map latencies.
+#
+#   python benchmarks/bench_concurrency.py [--configs 1:1:0 1:4:0 1:4:1 2:1:0 2:2:1] [--clients 8] [--seconds 6]
+#
+# A configuration is workers:threads:pool workers (MIGRATION_POOL_WORKERS); more than one thread switches gunicorn
+# to its gthread worker.
+import argparse
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+import numpy as np
+
+from bench_memory import BASE_DIR, free_port
+
+sys.path.insert(0, BASE_DIR)
+
+import app
+from dash._utils import split_callback_id
+
+
+def payload(callback_id, inputs, values):
+    return json.dumps({'output': callback_id,
+                       'outputs': split_callback_id(callback_id),
+                       'inputs': [dict(i, value=values[i['id']]) for i in inputs],
+                       'changedPropIds': [i['id'] + '.' + i['property'] for i in inputs]}).encode()
+
+
+def callback(name):
+    for callback_id, entry in app.app.callback_map.items():
+        if 'callback' in entry and entry['callback'].__wrapped__.__name__ == name:
+            return callback_id, entry['inputs']
+
+
+def post(url, body):
+    start = time.perf_counter()
+    request = urllib.request.Request(url, body, {'Content-Type': 'application/json'})
+    urllib.request.urlopen(request, timeout=120).read()
+    return start, time.perf_counter() - start
+
+
+def start_server(workers, threads, pool):
+    port = free_port()
+    env = dict(os.environ, MIGRATION_POOL_WORKERS=str(pool) if pool else '')
+    master = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--workers', str(workers),
+                               '--threads', str(threads), '--bind', '127.0.0.1:' + str(port), 'app:server'],
+                              cwd=BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 300
+    while time.time() < deadline:
+        try:
+            for _ in range(workers * 2):
+                urllib.request.urlopen('http://127.0.0.1:{}/_dash-layout'.format(port), timeout=30).read()
+            # let the build pool processes (if any) finish starting
+            time.sleep(3)
+            return master, 'http://127.0.0.1:{}/_dash-update-component'.format(port)
+        except OSError:
+            time.sleep(0.5)
+    master.kill()
+    raise RuntimeError('gunicorn did not start')
+
+
+def run(workers, threads, pool, clients, seconds):
+    snap = app.snapshots.current
+    boxes_id, boxes_inputs = callback('update_boxes')
+    map_id, map_inputs = callback('update_graph')
+
+    master, url = start_server(workers, threads, pool)
+    try:
+        stop = time.perf_counter() + seconds
+        boxes = []
+        maps = []
+
+        def lookups(seed):
+            rng = random.Random(seed)
+            while time.perf_counter() < stop:
+                values = {'country_drop': rng.choice(snap.countries), 'year_slider': rng.choice(snap.years)}
+                boxes.append(post(url, payload(boxes_id, boxes_inputs, values)))
+
+        def map_request(migvar):
+            maps.append(post(url, payload(map_id, map_inputs, {'mig_radio': migvar})))
+
+        threads_ = [threading.Thread(target=lookups, args=(i,)) for i in range(clients)]
+        for thread in threads_:
+            thread.start()
+        time.sleep(1)
+        map_threads = [threading.Thread(target=map_request, args=(option['value'],))
+                       for option in app.mig_options for _ in range(2)]
+        for thread in map_threads:
+            thread.start()
+        for thread in map_threads + threads_:
+            thread.join()
+    finally:
+        master.send_signal(signal.SIGTERM)
+        master.wait()
+
+    # the window from the first map request to the last map answer
+    first = min(start for start, _ in maps)
+    last = max(start + elapsed for start, elapsed in maps)
+    during = np.array([e for s, e in boxes if first <= s <= last]) * 1000
+    after = np.array([e for s, e in boxes if s > last]) * 1000
+    print('workers={} threads={} pool={}: boxes {:6.1f} req/s  during maps p50={:8.1f}ms p95={:8.1f}ms n={:<4} '
+          'after p50={:6.1f}ms p95={:6.1f}ms  maps max={:6.2f}s'.format(
+              workers, threads, pool, len(boxes) / seconds,
+              np.percentile(during, 50) if len(during) else float('nan'),
+              np.percentile(during, 95) if len(during) else float('nan'), len(during),
+              np.percentile(after, 50) if len(after) else float('nan'),
+              np.percentile(after, 95) if len(after) else float('nan'),
+              max(elapsed for _, elapsed in maps)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--configs', nargs='+', default=['1:1:0', '1:4:0', '1:4:1', '2:1:0', '2:2:1'])
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=6)
+    args = parser.parse_args()
+
+    print('{} CPUs'.format(os.cpu_count()))
+    for config in args.configs:
+        run(*(int(v) for v in config.split(':')), args.clients, args.seconds)
@@ -0,0 +1,33 @@
+# Per-request latency of the corridor map over every year and arc count: the top corridors found by sorting the
+# year's rows of df (what a request would cost without the index) vs read from the per year ranking of the
+# snapshot, and the whole callback (ranking lookup and figure) with the size of its response.
+#
+#   python benchmarks/bench_corridors.py
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+from bench_boxes import run
+
+snap = app.snapshots.current
+counts = [option['value'] for option in app.corridor_options]
+
+
+def sort_top(year, count):
+    df = snap.df
+    df_year = df.loc[(df['Year'] == year) & (df['Inflow'] > 0)]
+    return df_year.sort_values(by=['Inflow'], ascending=False).head(count)
+
+
+if __name__ == '__main__':
+    grid = [(year, count) for year in snap.years for count in counts]
+    update_corridors = app.update_corridors.__wrapped__
+    update_corridors(*grid[0])
+
+    run('sort', sort_top, grid)
+    run('index', snap.corridors.top, grid)
+    run('callback', update_corridors, grid)
+    for count in counts:
+        print('{:>4} arcs: {:>7} bytes'.format(count, len(update_corridors(snap.years[-1], count)[0])))
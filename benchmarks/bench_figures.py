@@ -0,0 +1,41 @@
+# Figure build time per callback: validating a fresh go.Figure per chart (what the callbacks used to do)
+# vs patching the prebuilt templates from figures.py.
+#
+#   python benchmarks/bench_figures.py
+import os
+import random
+import sys
+
+import plotly.graph_objs as go
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+from bench_boxes import run
+
+snap = app.snapshots.current
+
+
+def validated(func):
+    # the same figures, but rebuilt through go.Figure like the old callbacks did (plotly applies the
+    # default template itself, so the one embedded in the prebuilt layout is left out)
+    def wrapper(countries, year):
+        figs = []
+        for fig in func(countries, year):
+            layout = {k: v for k, v in fig['layout'].items() if k != 'template'}
+            figs.append(go.Figure(data=fig['data'], layout=layout).to_plotly_json())
+        return figs
+    return wrapper
+
+
+if __name__ == '__main__':
+    countries = [str(c) for c in snap.df_ind['Country'].unique()]
+    years = sorted(int(y) for y in snap.df_ind['Year'].unique())
+    random.seed(0)
+    grid = [(random.choice(countries), random.choice(years)) for _ in range(50)]
+
+    callbacks = [('hbar', app.update_hbars),
+                 ('indicators', app.update_indicators)]
+    for name, func in callbacks:
+        run(name + ' go', validated(func), grid)
+        run(name + ' tpl', func, grid)
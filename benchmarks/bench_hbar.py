@@ -0,0 +1,37 @@
+# Per-request latency of the top origins lookup behind hbar1/hbar2 over the full country x year grid:
+# the former filter + two full sort_values vs the (destination, year) rows of the flow tensor.
+#
+#   python benchmarks/bench_hbar.py
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+from bench_boxes import run
+
+snap = app.snapshots.current
+
+
+def sort_top(countries, year, k=app.top_n):
+    df = snap.df
+    df_year = df.loc[df['Year'] == year]
+    df_year_country = df_year.loc[df_year['Country'] == countries]
+    top_in = df_year_country.loc[df_year_country['Inflow'] > 0].sort_values(by=['Inflow'], ascending=False).head(k)
+    top_out = df_year_country.loc[df_year_country['Outflow'] > 0].sort_values(by=['Outflow'], ascending=False).head(k)
+    return top_in, top_out
+
+
+def index_top(countries, year, k=app.top_n):
+    return (snap.flow_tensor.top(countries, year, 'Inflow', k),
+            snap.flow_tensor.top(countries, year, 'Outflow', k))
+
+
+if __name__ == '__main__':
+    countries = [str(c) for c in snap.df_ind['Country'].unique()]
+    years = sorted(int(y) for y in snap.df_ind['Year'].unique())
+    grid = [(c, y) for c in countries for y in years]
+
+    run('before', sort_top, grid)
+    run('after', index_top, grid)
+    run('after, top 40', lambda c, y: index_top(c, y, k=40), grid)
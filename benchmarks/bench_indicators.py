@@ -0,0 +1,46 @@
+# Per-request cost of selecting the indicator window behind bar1-bar4/line over the full country x year grid:
+# the former boolean filtering of df_ind/df_avg vs slicing the precomputed IndicatorCube and StatisticsCube arrays.
+#
+#   python benchmarks/bench_indicators.py
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+from bench_boxes import run
+
+snap = app.snapshots.current
+
+df_avg = snap.df_ind.groupby('Year').mean(numeric_only=True).reset_index()
+
+
+def window(year):
+    year_aux = year-3
+    if (year_aux<2010 and year<=2010):
+        year_aux=2008
+        year = 2010
+    return year_aux, year
+
+
+def filter_frames(countries, year):
+    year_aux, year = window(year)
+    dff = snap.df_ind[(snap.df_ind['Year'] >= year_aux) & (snap.df_ind['Year'] <= year)]
+    dff_avg = df_avg[(df_avg['Year'] >= year_aux) & (df_avg['Year'] <= year)]
+    return dff.loc[(dff['Country'] == countries)], dff_avg
+
+
+def slice_cube(countries, year):
+    year_aux, year = window(year)
+    return (snap.indicator_cube.window(countries, year_aux, year),
+            snap.indicator_stats.mean_window(year_aux, year),
+            snap.flow_cube.window(countries, year_aux, year))
+
+
+if __name__ == '__main__':
+    countries = [str(c) for c in snap.df_ind['Country'].unique()]
+    years = sorted(int(y) for y in snap.df_ind['Year'].unique())
+    grid = [(c, y) for c in countries for y in years]
+
+    run('before', filter_frames, grid)
+    run('after', slice_cube, grid)
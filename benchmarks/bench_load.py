@@ -0,0 +1,185 @@
+# Load test of the callbacks through Flask's test client (no browser, no network): interaction traces are replayed
+# as the browser posts them to /_dash-update-component, and throughput, p50/p95/p99 latency and response bytes are
+# reported per callback.
+#
+#   python benchmarks/bench_load.py [--trace walk|scrub|radio|all] [--steps 300] [--seed 0] [--processes 4]
+#                                   [--json results.json] [--compare baseline.json] [--tolerance 0.2]
+#
+# Traces: `walk` changes the country or the year at random at every step, `scrub` drags the year slider back and
+# forth (switching country at each end), `radio` toggles the migration variable of the map. Every trace starts with
+# a page load, which fires all the callbacks. The app runs as configured by the environment (MIGRATION_BATCHED,
+# MIGRATION_MEMO_SIZE, ...), so the memo hits of a trace are part of its numbers.
+#
+# --processes N mirrors gunicorn.conf.py: app.py is imported once, the figure templates are built and the gc frozen,
+# then N workers are forked, each replaying its own trace (seeded per worker). --json saves the results, --compare
+# exits with 1 when a callback's p95 is more than --tolerance slower than in a saved baseline.
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+import figures
+from dash._utils import split_callback_id
+
+TRACES = ['walk', 'scrub', 'radio']
+
+
+def server_callbacks(dash_app):
+    # callback id -> (label, inputs) of the callbacks answered by the server
+    return {callback_id: (entry['callback'].__wrapped__.__name__, entry['inputs'])
+            for callback_id, entry in dash_app.callback_map.items() if 'callback' in entry}
+
+
+def make_trace(kind, steps, rng, countries, years, migvars):
+    # one {input id: new value} per interaction, the first one sets every input (the page load)
+    country = 'Afghanistan'
+    events = [{'country_drop': country, 'year_slider': years[-1], 'mig_radio': migvars[0], 'corridor_count': 50,
+               'compare_drop': app.compare_default, 'range_slider': [years[0], years[-1]], 'range_indicator': 0}]
+
+    period = 2 * (len(years) - 1)
+    for step in range(1, steps + 1):
+        if kind == 'walk':
+            if rng.random() < .5:
+                events.append({'country_drop': rng.choice(countries)})
+            else:
+                events.append({'year_slider': rng.choice(years)})
+        elif kind == 'scrub':
+            i = step % period
+            event = {'year_slider': years[len(years) - 1 - i] if i < len(years) else years[i - len(years) + 1]}
+            if i == 0:
+                event['country_drop'] = rng.choice(countries)
+            events.append(event)
+        else:
+            events.append({'mig_radio': migvars[step % len(migvars)]})
+    return events
+
+
+def replay(client, callbacks, events):
+    # post every callback whose inputs an event changes; returns callback id -> [(seconds, bytes)]
+    samples = {callback_id: [] for callback_id in callbacks}
+    values = {}
+    for event in events:
+        values.update(event)
+        for callback_id, (_, inputs) in callbacks.items():
+            if not any(i['id'] in event for i in inputs):
+                continue
+
+            payload = {'output': callback_id,
+                       'outputs': split_callback_id(callback_id),
+                       'inputs': [dict(i, value=values[i['id']]) for i in inputs],
+                       'changedPropIds': [i['id'] + '.' + i['property'] for i in inputs if i['id'] in event]}
+            start = time.perf_counter()
+            response = client.post('/_dash-update-component', json=payload)
+            elapsed = time.perf_counter() - start
+            if response.status_code != 200:
+                raise RuntimeError('{} answered {} for {}'.format(callback_id, response.status_code, payload['inputs']))
+            samples[callback_id].append((elapsed, len(response.data)))
+    return samples
+
+
+def run_trace(kind, steps, seed):
+    snap = app.snapshots.current
+    migvars = [option['value'] for option in app.mig_options]
+    events = make_trace(kind, steps, random.Random(seed), snap.countries, snap.years, migvars)
+
+    start = time.perf_counter()
+    samples = replay(app.server.test_client(), server_callbacks(app.app), events)
+    return samples, time.perf_counter() - start
+
+
+def _worker(job):
+    return run_trace(*job)
+
+
+def run_processes(kind, steps, seed, processes):
+    # like gunicorn.conf.py: everything is built in the parent, the workers share it copy-on-write
+    figures.build_templates()
+    gc.freeze()
+
+    start = time.perf_counter()
+    with multiprocessing.get_context('fork').Pool(processes) as pool:
+        results = pool.map(_worker, [(kind, steps, seed + i) for i in range(processes)])
+    wall = time.perf_counter() - start
+
+    samples = {}
+    for worker_samples, _ in results:
+        for callback_id, values in worker_samples.items():
+            samples.setdefault(callback_id, []).extend(values)
+    return samples, wall
+
+
+def summarize(samples, wall, callbacks):
+    rows = {}
+    for callback_id, values in samples.items():
+        if not values:
+            continue
+        seconds = np.array([s for s, _ in values]) * 1000
+        sizes = np.array([b for _, b in values])
+        rows[callbacks[callback_id][0]] = {'requests': len(values),
+                                           'throughput': len(values) / wall,
+                                           'p50_ms': np.percentile(seconds, 50),
+                                           'p95_ms': np.percentile(seconds, 95),
+                                           'p99_ms': np.percentile(seconds, 99),
+                                           'mean_bytes': sizes.mean(),
+                                           'total_bytes': int(sizes.sum())}
+    return rows
+
+
+def print_rows(kind, rows, wall):
+    total = sum(row['requests'] for row in rows.values())
+    print('{} trace: {} requests in {:.2f}s, {:.1f} req/s'.format(kind, total, wall, total / wall))
+    for label, row in rows.items():
+        print('  {:<20} requests={:<6} {:8.1f} req/s p50={:8.2f}ms p95={:8.2f}ms p99={:8.2f}ms bytes={:10.0f}'.format(
+            label, row['requests'], row['throughput'], row['p50_ms'], row['p95_ms'], row['p99_ms'], row['mean_bytes']))
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for kind, rows in results.items():
+        for label, row in rows.items():
+            base = baseline.get(kind, {}).get(label)
+            if base and row['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+                regressions.append('{} {}: p95 {:.2f}ms -> {:.2f}ms'.format(kind, label, base['p95_ms'], row['p95_ms']))
+    for regression in regressions:
+        print('REGRESSION', regression)
+    return not regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--trace', choices=TRACES + ['all'], default='all')
+    parser.add_argument('--steps', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    callbacks = server_callbacks(app.app)
+    results = {}
+    for kind in TRACES if args.trace == 'all' else [args.trace]:
+        if args.processes > 1:
+            samples, wall = run_processes(kind, args.steps, args.seed, args.processes)
+        else:
+            samples, wall = run_trace(kind, args.steps, args.seed)
+        results[kind] = summarize(samples, wall, callbacks)
+        print_rows(kind, results[kind], wall)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            if not compare(results, json.load(f), args.tolerance):
+                sys.exit(1)
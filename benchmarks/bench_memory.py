@@ -0,0 +1,100 @@
+# Memory of the data model and of the gunicorn workers.
+#
+#   python benchmarks/bench_memory.py [--workers 4]
+#
+# Prints the deep size of df/df_ind as parsed from Excel vs the compact cached frames, then starts gunicorn
+# twice, without preloading (every worker imports app.py itself) and with gunicorn.conf.py (preload + fork),
+# and reports RSS / PSS / shared / private memory of every worker from /proc/<pid>/smaps_rollup (Linux).
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import pandas as pd
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+import data
+
+
+def frame_sizes():
+    for name in (data.MIGRATION_FILE, data.INDICATORS_FILE):
+        raw = pd.read_excel(os.path.join(data.DATA_DIR, name))
+        cached = data.load_table(name)
+        print('{:<28} excel {:8.1f} MB   cached {:8.1f} MB'.format(
+            name, raw.memory_usage(deep=True).sum() / 2**20, cached.memory_usage(deep=True).sum() / 2**20))
+
+
+def smaps(pid):
+    values = {}
+    with open('/proc/{}/smaps_rollup'.format(pid)) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                values[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return values
+
+
+def children(pid):
+    with open('/proc/{}/task/{}/children'.format(pid, pid)) as f:
+        return [int(p) for p in f.read().split()]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def measure(label, config, workers):
+    port = free_port()
+    master = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', config, '--workers', str(workers),
+                               '--bind', '127.0.0.1:' + str(port), 'app:server'],
+                              cwd=BASE_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        # wait for every worker to answer
+        deadline = time.time() + 300
+        while time.time() < deadline:
+            try:
+                for _ in range(workers * 2):
+                    urllib.request.urlopen('http://127.0.0.1:{}/_dash-layout'.format(port), timeout=30).read()
+                if len(children(master.pid)) == workers:
+                    break
+            except OSError:
+                time.sleep(0.5)
+        time.sleep(1)
+
+        total = {}
+        print(label)
+        for pid in children(master.pid):
+            m = smaps(pid)
+            shared = m.get('Shared_Clean', 0) + m.get('Shared_Dirty', 0)
+            private = m.get('Private_Clean', 0) + m.get('Private_Dirty', 0)
+            print('  worker {:>7}  rss {:7.1f} MB  pss {:7.1f} MB  shared {:7.1f} MB  private {:7.1f} MB'.format(
+                pid, m['Rss'], m['Pss'], shared, private))
+            for key, value in (('rss', m['Rss']), ('pss', m['Pss']), ('private', private)):
+                total[key] = total.get(key, 0) + value
+        print('  total          rss {rss:7.1f} MB  pss {pss:7.1f} MB                     private {private:7.1f} MB'.format(**total))
+    finally:
+        master.send_signal(signal.SIGTERM)
+        master.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    frame_sizes()
+    # make sure the cache exists, so both runs start from it
+    data.load_data()
+
+    with tempfile.NamedTemporaryFile('w', suffix='.py') as empty:
+        measure('without preload', empty.name, args.workers)
+    measure('gunicorn.conf.py (preload + gc.freeze)', os.path.join(BASE_DIR, 'gunicorn.conf.py'), args.workers)
@@ -0,0 +1,67 @@
+# Response size and encoding time per figure: dash's json.dumps of the full figures (what the callbacks used to
+# send) vs serving.encode of the compact ones (choropleth values rounded, constant frame attributes dropped),
+# and what gzip / brotli make of them.
+#
+#   python benchmarks/bench_payload.py [--repeat 20]
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+
+import plotly
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+import figures
+import serving
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+snap = app.snapshots.current
+
+
+def timed(func, value, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func(value)
+    return result, (time.perf_counter() - start) / repeat * 1000
+
+
+def plotly_json(value):
+    return json.dumps(value, cls=plotly.utils.PlotlyJSONEncoder)
+
+
+def report(name, before, after, repeat):
+    before_json, before_ms = timed(plotly_json, before, repeat)
+    after_json, after_ms = timed(serving.encode, after, repeat)
+    data = after_json.encode()
+    gzipped, gzip_ms = timed(lambda d: gzip.compress(d, 6), data, repeat)
+    line = '{:<22} json {:>8} -> {:>8} bytes  encode {:7.2f} -> {:6.2f}ms  gzip {:>7} bytes {:6.2f}ms'.format(
+        name, len(before_json), len(data), before_ms, after_ms, len(gzipped), gzip_ms)
+    if brotli is not None:
+        compressed, br_ms = timed(lambda d: brotli.compress(d, quality=5), data, repeat)
+        line += '  br {:>7} bytes {:6.2f}ms'.format(len(compressed), br_ms)
+    print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    for option in app.mig_options:
+        migvar = option['value']
+        report('choropleth ' + migvar,
+               figures.choropleth_figure(snap.sum_mig, migvar, compact=False),
+               figures.choropleth_figure(snap.sum_mig, migvar),
+               args.repeat)
+
+    for name, update in [('boxes', app.update_boxes), ('hbars', app.update_hbars), ('indicators', app.update_indicators)]:
+        values = update('Portugal', 2015)
+        report(name, values, values, args.repeat)
@@ -0,0 +1,72 @@
+# Preprocessing of the workbooks: parsing them (pd.read_excel then compact, as the cache used to be built, vs the
+# chunked data.read_table) and aggregating the flows per (Country, Year) (a groupby vs the single pass
+# snapshot.aggregate_flows, with 1..N threads). Every parse runs in a fresh process, so its peak memory is its own:
+# the baseline is the peak right after the imports.
+#
+#   python benchmarks/bench_preprocess.py [--chunk-rows 16384] [--workers 4] [--repeat 20]
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+import pandas as pd
+
+import data
+import snapshot
+
+PARSERS = {'read_excel': lambda path, chunk_rows: data.compact(pd.read_excel(path)),
+           'chunked': lambda path, chunk_rows: data.read_table(path, chunk_rows)}
+
+
+def parse(parser, name, chunk_rows):
+    # run in the child process
+    baseline = data.peak_rss()
+    start = time.perf_counter()
+    frame = PARSERS[parser](os.path.join(data.DATA_DIR, name), chunk_rows)
+    print(json.dumps({'seconds': time.perf_counter() - start, 'baseline_mb': baseline, 'peak_mb': data.peak_rss(),
+                      'rows': len(frame)}))
+
+
+def parse_in_child(parser, name, chunk_rows):
+    output = subprocess.run([sys.executable, '-W', 'ignore', __file__, '--child', parser, name, str(chunk_rows)],
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def timed(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunk-rows', type=int, default=data.CHUNK_ROWS)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--child', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        parse(args.child[0], args.child[1], int(args.child[2]))
+        sys.exit()
+
+    for name in (data.MIGRATION_FILE, data.INDICATORS_FILE):
+        for method in PARSERS:
+            result = parse_in_child(method, name, args.chunk_rows)
+            print('{:<28} {:<10} rows={:<7} {:6.2f}s  peak {:6.1f} MB (+{:.1f} MB over the imports)'.format(
+                name, method, result['rows'], result['seconds'], result['peak_mb'],
+                result['peak_mb'] - result['baseline_mb']))
+
+    df, _ = data.load_data()
+    groupby = lambda: df.groupby([df['Country'].astype(str), 'Year'])[snapshot.FLOW_COLUMNS].sum().sort_index()
+    print('aggregate groupby    {:6.2f} ms'.format(timed(groupby, args.repeat)))
+    for workers in range(1, args.workers + 1):
+        print('aggregate {} thread(s) {:6.2f} ms'.format(workers, timed(
+            lambda: snapshot.aggregate_flows(df, workers), args.repeat)))
@@ -0,0 +1,44 @@
+# Cost of the long-range chart by series length: synthetic inflow/outflow/indicator series (random walks, from the
+# 10 annual points of the workbooks up to a million) drawn as they are vs downsampled by each method of
+# downsample.py to --points points per line. Reports the time to downsample, build and encode the figure, the
+# response size and the points the browser gets.
+#
+#   python benchmarks/bench_range.py [--lengths 10 1200 36500 1000000] [--points 1000] [--repeat 5]
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import downsample
+import figures
+import serving
+
+
+def response(x, series, points, method):
+    lines = [downsample.downsample(x, y, points, method) if method else (x, y) for y in series]
+    return serving.encode(figures.range_figure('Synthetic', x[0], x[-1], *lines, 0)), sum(len(l[0]) for l in lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lengths', type=int, nargs='+', default=[10, 1200, 36500, 1000000])
+    parser.add_argument('--points', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    figures.range_template()
+    rng = np.random.default_rng(0)
+    for length in args.lengths:
+        x = 2008 + np.arange(length) / max(length / 10, 1)
+        series = [np.abs(np.cumsum(rng.normal(size=length))) * 1000 for _ in range(3)]
+        for method in [None] + downsample.METHODS:
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                body, points = response(x, series, args.points, method)
+            elapsed = (time.perf_counter() - start) / args.repeat * 1000
+            print('{:>8} points {:<7} {:9.2f}ms {:>11} bytes {:>8} points sent'.format(
+                length, method or 'raw', elapsed, len(body), points))
@@ -0,0 +1,59 @@
+# Worker cold start: wall time of `import app`, the slowest imports from `python -X importtime`, and the
+# latency of the first request to each callback (which pays for whatever initialization was deferred).
+#
+#   python benchmarks/bench_startup.py [--runs 3] [--top 20]
+import argparse
+import os
+import subprocess
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FIRST_REQUESTS = '''
+import time
+start = time.perf_counter()
+import app
+print('import app {:.3f}s'.format(time.perf_counter() - start))
+
+from dash._utils import split_callback_id
+client = app.server.test_client()
+values = {'country_drop': 'Portugal', 'year_slider': 2015, 'mig_radio': 'norm Net', 'corridor_count': 50,
+          'compare_drop': ['Portugal', 'Spain'], 'range_slider': [2008, 2017], 'range_indicator': 0}
+for callback_id, entry in app.app.callback_map.items():
+    if 'callback' not in entry:
+        continue
+    inputs = [dict(i, value=values[i['id']]) for i in entry['inputs']]
+    start = time.perf_counter()
+    client.post('/_dash-update-component', json={'output': callback_id, 'outputs': split_callback_id(callback_id),
+                                                 'inputs': inputs, 'changedPropIds': []})
+    print('first request {:.3f}s  {}'.format(time.perf_counter() - start, callback_id))
+'''
+
+
+def import_profile():
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-W', 'ignore', '-c', 'import app'],
+                            cwd=BASE_DIR, capture_output=True, text=True, check=True)
+    rows = []
+    # lines look like 'import time:   self [us] | cumulative | imported package'
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative_us), int(self_us), name.rstrip()))
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--top', type=int, default=20)
+    args = parser.parse_args()
+
+    for run in range(args.runs):
+        subprocess.run([sys.executable, '-W', 'ignore', '-c', FIRST_REQUESTS], cwd=BASE_DIR, check=True)
+        print()
+
+    rows = import_profile()
+    print('slowest imports (-X importtime, cumulative / self):')
+    for cumulative_us, self_us, name in sorted(rows, reverse=True)[:args.top]:
+        print('{:9.3f}s {:9.3f}s  {}'.format(cumulative_us / 1e6, self_us / 1e6, name))
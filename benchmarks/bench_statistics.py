@@ -0,0 +1,43 @@
+# Per-request cost of the statistics behind the indicator charts (global average, percentile band, country rank)
+# over the full country x year grid: a groupby/rank of df_ind per request vs reading the snapshot's StatisticsCube,
+# and what building the cube costs once per snapshot.
+#
+#   python benchmarks/bench_statistics.py
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+import figures
+import indexes
+from bench_boxes import run
+
+snap = app.snapshots.current
+columns = [column for column, _, _, _ in figures.INDICATORS]
+
+
+def group_frames(countries, year):
+    dff = snap.df_ind[(snap.df_ind['Year'] >= year - 3) & (snap.df_ind['Year'] <= year)]
+    by_year = dff.groupby('Year')[columns]
+    dff_year = snap.df_ind[snap.df_ind['Year'] == year].set_index('Country')[columns]
+    ranks = dff_year.rank(ascending=False, method='min')
+    return (by_year.mean(), by_year.quantile(figures.BAND[0]), by_year.quantile(figures.BAND[1]),
+            ranks.loc[countries] if countries in ranks.index else None, dff_year.count())
+
+
+def read_cube(countries, year):
+    stats = snap.indicator_stats
+    return stats.mean_window(year - 3, year), stats.band(year - 3, year, *figures.BAND), stats.ranking(countries, year)
+
+
+if __name__ == '__main__':
+    grid = [(c, y) for c in snap.countries for y in snap.years]
+
+    start = time.perf_counter()
+    indexes.StatisticsCube(snap.indicator_cube)
+    print('build {:.1f}ms'.format((time.perf_counter() - start) * 1000))
+
+    run('groupby', group_frames, grid)
+    run('cube', read_cube, grid)
@@ -0,0 +1,67 @@
+# Does the cost of a selection grow with the size of the bilateral data? The workbook rows are replicated into
+# more years (every copy shifted by the number of years in the data) until the table has --scale times as many
+# rows, the flow tensor is built from it, and the top origins, text box totals and slices by origin and by year
+# are timed over random selections. The lookups should stay flat while the rows grow.
+#
+#   python benchmarks/bench_tensor.py [--scales 1 10 50] [--requests 2000]
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import data
+import indexes
+
+
+def replicated(df, scale):
+    span = int(df['Year'].max() - df['Year'].min() + 1)
+    copies = []
+    for i in range(scale):
+        copy = df.copy()
+        copy['Year'] = (copy['Year'].astype(np.int64) + i * span).astype(np.int32)
+        copies.append(copy)
+    return pd.concat(copies, ignore_index=True)
+
+
+def timed(func, selections):
+    timings = []
+    for selection in selections:
+        start = time.perf_counter()
+        func(*selection)
+        timings.append(time.perf_counter() - start)
+    timings = np.array(timings) * 1e6
+    return '{:7.1f}us p95 {:7.1f}us'.format(timings.mean(), np.percentile(timings, 95))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 50])
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    df, _ = data.load_data()
+    for scale in args.scales:
+        frame = replicated(df, scale)
+        start = time.perf_counter()
+        tensor = indexes.FlowTensor(frame)
+        build = time.perf_counter() - start
+        size = tensor.indptr.nbytes + tensor.indices.nbytes + tensor.entry_destinations.nbytes + \
+            tensor.by_origin.nbytes + tensor.origin_indptr.nbytes + sum(v.nbytes for v in tensor.values.values())
+
+        rng = random.Random(0)
+        years = [int(year) for year in tensor.years]
+        selections = [(rng.choice(list(tensor.destinations)), rng.choice(years)) for _ in range(args.requests)]
+        origins = [(str(rng.choice(list(tensor.origins))), year) for _, year in selections]
+
+        print('rows={:<9} build {:6.2f}s {:6.1f} MB'.format(len(frame), build, size / 2**20))
+        print('  top 10 in+out  ', timed(lambda c, y: (tensor.top(c, y, 'Inflow'), tensor.top(c, y, 'Outflow')),
+                                         selections))
+        print('  totals         ', timed(tensor.totals, selections))
+        print('  origin slice   ', timed(tensor.origin_slice, origins))
+        print('  year slice     ', timed(lambda c, y: tensor.year_slice(y), selections))
@@ -0,0 +1,58 @@
+# Restart cost with and without the warm cache: a fresh process imports the libraries, then app.py, then is made
+# fully warm (every figure template built, every choropleth encoded, one request to each callback). Cold builds all
+# of it; warm reads the entry that `warmcache.py build` wrote into a temporary directory.
+#
+#   python benchmarks/bench_warm.py [--runs 3]
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RESTART = '''
+import time
+start = time.perf_counter()
+import dash, dash_core_components, dash_html_components, flask, numpy, pandas, plotly
+libraries = time.perf_counter()
+import app
+imported = time.perf_counter()
+
+import figures
+from dash._utils import split_callback_id
+figures.build_templates()
+app.snapshots.current.choropleth.warm(option['value'] for option in app.mig_options)
+client = app.server.test_client()
+values = {'country_drop': 'Portugal', 'year_slider': 2015, 'mig_radio': 'norm Net', 'corridor_count': 50,
+          'compare_drop': ['Portugal', 'Spain'], 'range_slider': [2008, 2017], 'range_indicator': 0}
+for callback_id, entry in app.app.callback_map.items():
+    if 'callback' in entry:
+        client.post('/_dash-update-component', json={'output': callback_id, 'outputs': split_callback_id(callback_id),
+                                                     'inputs': [dict(i, value=values[i['id']]) for i in entry['inputs']],
+                                                     'changedPropIds': []})
+warm = time.perf_counter()
+print('libraries {:.2f}s  app.py {:.2f}s  templates, choropleths and first requests {:.2f}s  total {:.2f}s'.format(
+    libraries - start, imported - libraries, warm - imported, warm - start))
+'''
+
+
+def restart(label, env):
+    sys.stdout.write('{:<5} '.format(label))
+    sys.stdout.flush()
+    subprocess.run([sys.executable, '-W', 'ignore', '-c', RESTART], cwd=BASE_DIR, env=env, check=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        env = dict(os.environ)
+        env.pop('MIGRATION_WARM_CACHE', None)
+        subprocess.run([sys.executable, '-W', 'ignore', 'warmcache.py', 'build', '--path', path], cwd=BASE_DIR,
+                       env=env, check=True)
+        for _ in range(args.runs):
+            restart('cold', env)
+            restart('warm', dict(env, MIGRATION_WARM_CACHE=path))
@@ -0,0 +1,57 @@
+import flask
+
+import memo
+
+
+
+######################################################Compression#######################################################
+# Dash compresses responses with flask-compress but pins it to gzip. compress_responses sets it up instead: brotli
+# for the clients that accept it (gzip for the others), and an LRU of compressed callback responses so a selection
+# answered from the memo isn't compressed again on every request.
+
+# only these routes answer the same bytes for the same request body (and data version)
+CACHED_PATHS = {'/_dash-update-component'}
+
+
+class CompressedResponses:
+    # the COMPRESS_CACHE_BACKEND; flask-compress passes '<encoding>;<COMPRESS_CACHE_KEY>' keys
+
+    def __init__(self, maxsize, version):
+        self.cache = memo.LRUCache(maxsize)
+        self.version = version
+
+    def _key(self, key):
+        if flask.request.path not in CACHED_PATHS:
+            return None
+        return self.version() + ':' + key
+
+    def get(self, key):
+        key = self._key(key)
+        return None if key is None else self.cache.get(key)
+
+    def set(self, key, value):
+        key = self._key(key)
+        if key is not None:
+            self.cache.set(key, value)
+
+
+def _request_key(request):
+    return request.path + ':' + request.get_data(as_text=True)
+
+
+def compress_responses(server, version, cache_size=256, brotli_level=5):
+    # call with a dash app created with compress=False
+    from flask_compress import Compress
+
+    algorithms = ['gzip']
+    try:
+        import brotli
+        algorithms = ['br', 'gzip']
+    except ImportError:
+        pass
+
+    server.config.update(COMPRESS_ALGORITHM=algorithms,
+                         COMPRESS_BR_LEVEL=brotli_level,
+                         COMPRESS_CACHE_BACKEND=lambda: CompressedResponses(cache_size, version),
+                         COMPRESS_CACHE_KEY=_request_key)
+    return Compress(server)
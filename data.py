@@ -0,0 +1,275 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+
+
+######################################################Paths#############################################################
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.environ.get('MIGRATION_DATA_DIR', BASE_DIR)
+CACHE_DIR = os.environ.get('MIGRATION_CACHE_DIR', os.path.join(BASE_DIR, '.cache'))
+
+MIGRATION_FILE = 'Migration_In_Out.xlsx'
+INDICATORS_FILE = 'Migration_Indicators.xlsx'
+# approximate centroid of every country of the workbooks, by ISO 3166 alpha-3 code (shipped with the code)
+CENTROIDS_FILE = os.path.join(BASE_DIR, 'country_centroids.csv')
+
+# optional CSV of (code, region) pairs, ISO alpha-3 codes, for the regional rollups of the statistics cube
+REGIONS_FILE = os.environ.get('MIGRATION_REGIONS_FILE')
+
+CACHE_FORMAT = 2
+
+# rows of a workbook converted at a time when it is parsed (see read_table)
+CHUNK_ROWS = int(os.environ.get('MIGRATION_CHUNK_ROWS', 16384))
+
+
+######################################################Source files######################################################
+
+def file_hash(file_path):
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def source_stamp(file_path):
+    stat = os.stat(file_path)
+    return {'mtime': stat.st_mtime, 'size': stat.st_size}
+
+
+######################################################Columnar cache####################################################
+# Every workbook is stored as one directory holding a .npy file per column plus a meta.json.
+# String columns are kept as categorical codes and integer columns are downcast, so every array
+# is compact and can be memory-mapped, with the pages shared by all the workers reading the files.
+
+def _cache_path(name):
+    return os.path.join(CACHE_DIR, os.path.splitext(name)[0])
+
+
+def _read_meta(cache_path):
+    try:
+        with open(os.path.join(cache_path, 'meta.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _is_fresh(meta, file_path):
+    if meta is None or meta.get('format') != CACHE_FORMAT:
+        return False
+
+    stamp = source_stamp(file_path)
+    if meta['source']['mtime'] == stamp['mtime'] and meta['source']['size'] == stamp['size']:
+        return True
+
+    # a checkout or a copy changes the mtime but not the content
+    return meta['source']['sha1'] == file_hash(file_path)
+
+
+def compact(frame):
+    # strings become categoricals and integers are downcast (years and migrant counts fit in int16/int32);
+    # floats stay float64, they are shown at full precision
+    dtypes = {}
+    for column in frame.columns:
+        if frame[column].dtype == object:
+            dtypes[column] = 'category'
+        elif frame[column].dtype.kind in 'iu':
+            dtypes[column] = pd.to_numeric(frame[column], downcast='integer').dtype
+    return frame.astype(dtypes)
+
+
+######################################################Chunked reader####################################################
+# pd.read_excel holds every cell of the sheet as a Python object (and then a second, converted copy) before the
+# frame is compacted. read_table streams the sheet instead (openpyxl's read only mode parses the XML as it goes) and
+# converts it CHUNK_ROWS rows at a time, with the same cell conversion and type inference as read_excel; only the
+# compact chunks are kept, and they are concatenated once at the end.
+
+def _cell(value):
+    # as pandas' openpyxl reader: empty cells are '' (NaN after parsing), integral floats become ints
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _trimmed(row):
+    row = [_cell(value) for value in row]
+    while row and row[-1] == '':
+        row.pop()
+    return row
+
+
+def _parse_chunk(header, rows):
+    from pandas.io.parsers import TextParser
+
+    width = len(header)
+    data = [header] + [row + [''] * (width - len(row)) for row in rows]
+    return compact(TextParser(data, header=0).read())
+
+
+def iter_chunks(file_path, chunk_rows=CHUNK_ROWS):
+    # the first sheet as compact frames of up to chunk_rows rows; blank rows are kept unless they end the sheet
+    import openpyxl
+
+    book = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = book.worksheets[0].iter_rows(values_only=True)
+        header = _trimmed(next(rows, ()))
+        chunk, blank = [], []
+        chunks = 0
+        for row in rows:
+            row = _trimmed(row)
+            if not row:
+                blank.append(row)
+                continue
+            chunk.extend(blank)
+            blank = []
+            chunk.append(row)
+            if len(row) > len(header):
+                header = header + [''] * (len(row) - len(header))
+            if len(chunk) >= chunk_rows:
+                yield _parse_chunk(header, chunk)
+                chunk = []
+                chunks += 1
+        if chunk or not chunks:
+            yield _parse_chunk(header, chunk)
+    finally:
+        book.close()
+
+
+def _concat_column(parts):
+    if all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+        try:
+            return pd.Series(union_categoricals(parts, sort_categories=True))
+        except TypeError:
+            # categories of mixed types don't sort, read_excel leaves them in order of appearance
+            pass
+    # the chunks were inferred differently (e.g. ints, then floats with NaN): as read_excel would for the whole
+    # column, numbers are promoted and anything else mixed with strings is an object column again
+    return pd.concat([part.astype(object) if isinstance(part.dtype, pd.CategoricalDtype) else part
+                      for part in parts], ignore_index=True)
+
+
+def read_table(file_path, chunk_rows=CHUNK_ROWS):
+    # compact(pd.read_excel(file_path)), without the whole sheet in memory as Python objects
+    chunks = list(iter_chunks(file_path, chunk_rows))
+    # a column only a later row reached is missing from the chunks before it
+    columns = max((chunk.columns for chunk in chunks), key=len)
+    frame = pd.DataFrame({column: _concat_column([chunk[column] if column in chunk else
+                                                   pd.Series(np.nan, index=chunk.index) for chunk in chunks])
+                          for column in columns}, columns=columns)
+    return compact(frame)
+
+
+def write_cache(frame, file_path, cache_path):
+    tmp_path = cache_path + '.tmp-' + str(os.getpid())
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    columns = []
+    for i, column in enumerate(frame.columns):
+        values = frame[column]
+        entry = {'name': column, 'file': 'c' + str(i) + '.npy'}
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            entry['categories'] = [str(c) for c in values.cat.categories]
+            data = values.cat.codes.values
+        else:
+            data = values.values
+        np.save(os.path.join(tmp_path, entry['file']), np.ascontiguousarray(data))
+        columns.append(entry)
+
+    meta = {'format': CACHE_FORMAT,
+            'source': dict(source_stamp(file_path), sha1=file_hash(file_path)),
+            'rows': len(frame),
+            'columns': columns}
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    # swap the finished directory in, so a worker never sees a half written cache
+    old_path = cache_path + '.old-' + str(os.getpid())
+    if os.path.exists(cache_path):
+        os.rename(cache_path, old_path)
+    os.rename(tmp_path, cache_path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return meta
+
+
+def read_cache(cache_path, meta):
+    data = {}
+    for entry in meta['columns']:
+        values = np.load(os.path.join(cache_path, entry['file']), mmap_mode='r')
+        if 'categories' in entry:
+            values = pd.Categorical.from_codes(values, categories=entry['categories'])
+        data[entry['name']] = values
+    return pd.DataFrame(data, columns=[entry['name'] for entry in meta['columns']], copy=False)
+
+
+def load_table(name):
+    file_path = os.path.join(DATA_DIR, name)
+    cache_path = _cache_path(name)
+
+    meta = _read_meta(cache_path)
+    if not _is_fresh(meta, file_path):
+        frame = read_table(file_path)
+        try:
+            meta = write_cache(frame, file_path, cache_path)
+        except OSError:
+            # read only deployments still work, they only pay the Excel parse on every start
+            return frame
+    return read_cache(cache_path, meta)
+
+
+def load_data():
+    return load_table(MIGRATION_FILE), load_table(INDICATORS_FILE)
+
+
+def load_centroids():
+    # ISO alpha-3 code -> (longitude, latitude)
+    centroids = pd.read_csv(CENTROIDS_FILE)
+    return dict(zip(centroids['code'], zip(centroids['longitude'], centroids['latitude'])))
+
+
+def load_regions():
+    # ISO alpha-3 code -> region, empty without a REGIONS_FILE
+    if not REGIONS_FILE:
+        return {}
+    regions = pd.read_csv(REGIONS_FILE, dtype=str)
+    return dict(zip(regions['code'], regions['region']))
+
+
+def source_stamps():
+    # cheap change detection for the refresh watcher: one stat() per workbook
+    return {name: source_stamp(os.path.join(DATA_DIR, name)) for name in (MIGRATION_FILE, INDICATORS_FILE)}
+
+
+def data_version():
+    # identifies the content of both workbooks, e.g. to namespace memoized responses
+    sha1 = hashlib.sha1()
+    for name in (MIGRATION_FILE, INDICATORS_FILE):
+        sha1.update(file_hash(os.path.join(DATA_DIR, name)).encode())
+    return sha1.hexdigest()[:12]
+
+
+def peak_rss():
+    # peak resident memory of this process so far, in MB (Linux reports ru_maxrss in kB)
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+if __name__ == '__main__':
+    # build (or refresh) the cache ahead of time, e.g. during a deploy
+    import time
+
+    for name in (MIGRATION_FILE, INDICATORS_FILE):
+        start = time.time()
+        table = load_table(name)
+        print(name, '->', _cache_path(name), table.shape, '{:.1f}s'.format(time.time() - start))
+    print('peak memory {:.0f} MB'.format(peak_rss()))
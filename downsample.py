@@ -0,0 +1,83 @@
+import numpy as np
+
+
+######################################################Downsampling######################################################
+# A line never needs more points than the chart has pixels across, so long series are cut down to `threshold` points
+# before they are sent. LTTB (largest triangle three buckets) keeps the visual shape of the line; min-max keeps the
+# lowest and the highest point of every bucket, so no spike is lost. Both keep the first and the last point, and both
+# return the series untouched when it is already short enough.
+
+METHODS = ['lttb', 'minmax']
+
+# LTTB buckets up to this size are scanned in plain Python
+SMALL_BUCKET = 16
+
+
+def lttb(x, y, threshold):
+    length = len(y)
+    if threshold >= length or threshold < 3:
+        return x, y
+
+    xs = np.asarray(x, dtype=float)
+    ys = np.asarray(y, dtype=float)
+
+    # threshold - 2 buckets between the first and the last point, and the average point of every bucket
+    # (the far corner of the triangles of the bucket before it; the last point for the last bucket)
+    edges = np.linspace(1, length - 1, threshold - 1).astype(np.intp)
+    counts = np.diff(edges)
+    avg_x = np.append(np.add.reduceat(xs[:length - 1], edges[:-1]) / counts, xs[-1]).tolist()
+    avg_y = np.append(np.add.reduceat(ys[:length - 1], edges[:-1]) / counts, ys[-1]).tolist()
+
+    # the buckets only differ in size by one: with a few points each, plain floats beat a numpy call per bucket
+    small = counts.max() <= SMALL_BUCKET
+    if small:
+        xs, ys = xs.tolist(), ys.tolist()
+
+    selected = [0]
+    a = 0
+    for start, end, xc, yc in zip(edges[:-1].tolist(), edges[1:].tolist(), avg_x[1:], avg_y[1:]):
+        # twice the area of the triangle (selected point, candidate, next bucket's average) of every candidate,
+        # |p * y + q * x + r|
+        xa, ya = float(xs[a]), float(ys[a])
+        p, q, r = xa - xc, yc - ya, xc * ya - xa * yc
+        if small:
+            best = -1.0
+            for i in range(start, end):
+                area = abs(p * ys[i] + q * xs[i] + r)
+                if area > best:
+                    best, a = area, i
+        else:
+            a = start + int(np.abs(p * ys[start:end] + q * xs[start:end] + r).argmax())
+        selected.append(a)
+    selected.append(length - 1)
+
+    return np.asarray(x)[selected], np.asarray(y)[selected]
+
+
+def min_max(x, y, threshold):
+    y = np.asarray(y)
+    length = len(y)
+    if threshold >= length or threshold < 4:
+        return x, y
+
+    # (threshold - 2) / 2 buckets; the first point of every bucket equal to its minimum, and to its maximum
+    edges = np.linspace(0, length, (threshold - 2) // 2 + 1).astype(np.intp)
+    counts = np.diff(edges)
+    buckets = np.repeat(np.arange(len(counts)), counts)
+    selected = [[0, length - 1]]
+    for extreme in (np.minimum, np.maximum):
+        hits = np.flatnonzero(y == np.repeat(extreme.reduceat(y, edges[:-1]), counts))
+        selected.append(hits[np.unique(buckets[hits], return_index=True)[1]])
+
+    selected = np.unique(np.concatenate(selected))
+    return np.asarray(x)[selected], np.asarray(y)[selected]
+
+
+def downsample(x, y, threshold, method='lttb'):
+    # the points of (x, y) to draw, missing values (NaN) left out
+    y = np.asarray(y)
+    if y.dtype.kind == 'f':
+        keep = ~np.isnan(y)
+        if not keep.all():
+            x, y = np.asarray(x)[keep], y[keep]
+    return (min_max if method == 'minmax' else lttb)(x, y, threshold)
@@ -0,0 +1,184 @@
+import argparse
+import itertools
+import json
+import mmap
+import os
+import struct
+import time
+import zlib
+
+from dash._utils import split_callback_id
+
+import serving
+
+
+
+######################################################Artifact format###################################################
+# One file: the zlib compressed callback responses back to back, then a compressed JSON index
+# {key: [offset, length, dictionary]} and a fixed size trailer pointing at the index. Each callback gets
+# its own preset dictionary (one of its responses), so the layout and template JSON repeated in every
+# response compress away.
+
+MAGIC = b'MIGX0001'
+TRAILER = struct.Struct('<QQ8s')
+ZDICT_SIZE = 32 * 1024
+
+
+class ArtifactWriter:
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path + '.tmp', 'wb')
+        self.file.write(MAGIC)
+        self.index = {}
+        self.dictionaries = []
+        self.compressors = {}
+
+    def set_dictionary(self, name, sample):
+        self.compressors[name] = len(self.dictionaries)
+        self.dictionaries.append(sample[-ZDICT_SIZE:].decode('latin-1'))
+
+    def add(self, key, payload, dictionary=None):
+        if dictionary is None:
+            data, zdict = zlib.compress(payload, 9), -1
+        else:
+            zdict = self.compressors[dictionary]
+            compressor = zlib.compressobj(9, zdict=self.dictionaries[zdict].encode('latin-1'))
+            data = compressor.compress(payload) + compressor.flush()
+        self.index[key] = [self.file.tell(), len(data), zdict]
+        self.file.write(data)
+
+    def close(self, version=None):
+        index = {'entries': self.index, 'dictionaries': self.dictionaries, 'version': version}
+        index = zlib.compress(json.dumps(index).encode(), 9)
+        offset = self.file.tell()
+        self.file.write(index)
+        self.file.write(TRAILER.pack(offset, len(index), MAGIC))
+        self.file.close()
+        os.replace(self.path + '.tmp', self.path)
+
+
+class Artifact:
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        offset, length, magic = TRAILER.unpack(self.data[-TRAILER.size:])
+        if magic != MAGIC or self.data[:len(MAGIC)] != MAGIC:
+            raise ValueError(path + ' is not a migration export artifact')
+
+        index = json.loads(zlib.decompress(self.data[offset:offset + length]))
+        self.entries = index['entries']
+        self.dictionaries = [d.encode('latin-1') for d in index['dictionaries']]
+        # the data version the responses were computed from
+        self.version = index.get('version')
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        offset, length, zdict = entry
+        if zdict < 0:
+            return zlib.decompress(self.data[offset:offset + length]).decode()
+        decompressor = zlib.decompressobj(zdict=self.dictionaries[zdict])
+        return (decompressor.decompress(self.data[offset:offset + length]) + decompressor.flush()).decode()
+
+
+######################################################Export############################################################
+
+def input_domains(app_module):
+    # every value each interactive input can take
+    snap = app_module.snapshots.current
+    return {'country_drop': snap.countries,
+            'year_slider': snap.years,
+            'mig_radio': [option['value'] for option in app_module.mig_options],
+            'corridor_count': [option['value'] for option in app_module.corridor_options]}
+
+
+def export(app_module, path):
+    dash_app = app_module.app
+    domains = input_domains(app_module)
+    writer = ArtifactWriter(path)
+
+    for callback_id, entry in dash_app.callback_map.items():
+        inputs = [i['id'] for i in entry['inputs']]
+        if 'callback' not in entry or entry['state'] or any(i not in domains for i in inputs):
+            print('skipping', callback_id, '(inputs without a known domain)')
+            continue
+
+        # call the plain dispatch, bypassing the memo LRU
+        callback = getattr(entry['callback'], 'dispatch', entry['callback'])
+        outputs_list = split_callback_id(callback_id)
+
+        start = time.time()
+        combinations = list(itertools.product(*[domains[i] for i in inputs]))
+        for n, args in enumerate(combinations):
+            payload = callback(*args, outputs_list=outputs_list).encode()
+            if n == 0:
+                writer.set_dictionary(callback_id, payload)
+            writer.add(serving.callback_key(callback_id, args), payload, dictionary=callback_id)
+        print('{:<80} {:>6} responses {:7.1f}s'.format(callback_id, len(combinations), time.time() - start))
+
+    writer.close(version=app_module.snapshots.current.version)
+    print(path, len(writer.index), 'entries', os.path.getsize(path), 'bytes')
+
+
+######################################################Serving###########################################################
+
+def serve_from_artifact(app, artifact, version=None):
+    # answer every exported callback from the artifact; anything not in it falls back to computing,
+    # and so does everything once version() no longer matches the version the artifact was exported from
+    for callback_id, entry in app.callback_map.items():
+        # clientside callbacks have nothing to serve
+        if 'callback' in entry:
+            entry['callback'] = _artifact_callback(callback_id, entry['callback'], artifact, version)
+
+
+def _artifact_callback(callback_id, fallback, artifact, version):
+
+    def from_artifact(*args, outputs_list):
+        if version is not None and artifact.version is not None and version() != artifact.version:
+            return fallback(*args, outputs_list=outputs_list)
+
+        response = artifact.get(serving.callback_key(callback_id, args))
+        if response is None:
+            return fallback(*args, outputs_list=outputs_list)
+        return response
+
+    from_artifact.__wrapped__ = fallback.__wrapped__
+    from_artifact.dispatch = getattr(fallback, 'dispatch', fallback)
+    return from_artifact
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export every callback response of the dashboard into one artifact '
+                                                 '(serve it with MIGRATION_ARTIFACT=<path>)')
+    parser.add_argument('output', nargs='?', default='migration_export.bin')
+    parser.add_argument('--inspect', action='store_true', help='print the entries of an existing artifact')
+    args = parser.parse_args()
+
+    if args.inspect:
+        artifact = Artifact(args.output)
+        sizes = {}
+        for key, (_, length, _) in artifact.entries.items():
+            callback_id = key[:key.index('[')]
+            count, total = sizes.get(callback_id, (0, 0))
+            sizes[callback_id] = (count + 1, total + length)
+        print('data version', artifact.version)
+        for callback_id, (count, total) in sizes.items():
+            print('{:<80} {:>6} responses {:>10} bytes'.format(callback_id, count, total))
+    else:
+        # export what the app computes, not what an artifact already holds
+        os.environ.pop('MIGRATION_ARTIFACT', None)
+        os.environ.pop('MIGRATION_WARMUP', None)
+        import app
+        export(app, args.output)
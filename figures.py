@@ -0,0 +1,568 @@
+import functools
+
+import numpy as np
+
+
+######################################################Templates#########################################################
+# Every chart is built and validated by plotly once, on first use (or by build_templates, e.g. before the
+# gunicorn workers fork). The callbacks only patch the x/y arrays, titles and ranges into a shallow copy of
+# the template and return it as a plain dict, so no go.Figure (and none of its validation) is created per
+# request. plotly.graph_objs and plotly.express are only imported when a figure is first built.
+
+# every template function by name (see template), and the prebuilt templates load_templates was given
+TEMPLATES = {}
+_loaded = {}
+
+
+def template(func):
+    # a template function, built once per process unless a prebuilt one was loaded (e.g. from the warm cache)
+    @functools.lru_cache(maxsize=None)
+    @functools.wraps(func)
+    def cached():
+        if func.__name__ in _loaded:
+            return _loaded[func.__name__]
+        return func()
+
+    TEMPLATES[func.__name__] = cached
+    return cached
+
+
+def build_template(data, layout):
+    import plotly.graph_objs as go
+    return go.Figure(data=data, layout=layout).to_plotly_json()
+
+
+def _set(node, path, value):
+    # copy only the dicts along the path, everything else stays shared with the template
+    node = dict(node)
+    if len(path) == 1:
+        node[path[0]] = value
+    else:
+        node[path[0]] = _set(node.get(path[0], {}), path[1:], value)
+    return node
+
+
+def patch(template, traces=(), layout=None):
+    data = list(template['data'])
+    for i, trace in enumerate(traces):
+        data[i] = dict(data[i], **trace)
+
+    new_layout = template['layout']
+    for path, value in (layout or {}).items():
+        new_layout = _set(new_layout, path, value)
+
+    return {'data': data, 'layout': new_layout}
+
+
+######################################################Choropleth map####################################################
+# The normalized values only drive the colors (and the hover), so they are rounded to NORM_DECIMALS; the frames keep
+# only what changes from year to year (plotly.js keeps the other attributes of the trace when it animates).
+
+NORM_DECIMALS = 4
+
+
+def _equal(a, b):
+    if isinstance(a, (list, tuple, np.ndarray)) or isinstance(b, (list, tuple, np.ndarray)):
+        return np.array_equal(np.asarray(a, dtype=object), np.asarray(b, dtype=object))
+    return a == b
+
+
+def compact_frames(figure):
+    data = [dict(trace) for trace in figure['data']]
+    frames = [dict(frame, data=[dict(trace) for trace in frame['data']]) for frame in figure['frames']]
+
+    for i, trace in enumerate(data):
+        frame_traces = [frame['data'][i] for frame in frames]
+
+        # px sets hover_name as a hovertext array repeating the locations
+        if _equal(trace.get('hovertext'), trace.get('locations')) and \
+                all(_equal(t.get('hovertext'), t.get('locations')) for t in frame_traces):
+            trace['hovertemplate'] = trace['hovertemplate'].replace('%{hovertext}', '%{location}')
+            for t in [trace] + frame_traces:
+                t.pop('hovertext', None)
+                if 'hovertemplate' in t:
+                    t['hovertemplate'] = trace['hovertemplate']
+
+        # attributes that are the same in every frame stay on the trace only
+        for key in list(trace):
+            if key != 'type' and all(key in t and _equal(t[key], trace[key]) for t in frame_traces):
+                for t in frame_traces:
+                    del t[key]
+
+    return dict(figure, data=data, frames=frames)
+
+
+def choropleth_figure(sum_mig, migvar, compact=True):
+    import plotly.express as px
+    import plotly.graph_objs as go
+
+    if migvar=='norm Net':
+        new_migvar='Net-Migration'
+        hover_var = 'Net-Migration'
+    elif migvar=='norm Inflow':
+        new_migvar='Migrants Inflow'
+        hover_var='Inflow'
+    else:
+        new_migvar='Migrants Outflow'
+        hover_var='Outflow'
+
+    # countries are located by their ISO alpha-3 code (see validation.py), those without one cannot be drawn
+    sum_mig = sum_mig[sum_mig['Country-code'].notna()]
+    if compact:
+        sum_mig = sum_mig.assign(**{migvar: sum_mig[migvar].round(NORM_DECIMALS)})
+
+    data_choropleth = px.choropleth(sum_mig,
+                                    locations="Country-code",
+                                    locationmode="ISO-3",
+                                    color=migvar,
+                                    hover_name="Country",
+                                    hover_data=["Year", hover_var],
+                                    color_continuous_scale='YlGn',
+                                    animation_frame="Year",
+                                    projection="natural earth",
+                                    title=dict(text="<b>Global " + str(new_migvar) + '</b>', x=.5, font={"size": 20, 'family':'sans-serif',
+                                                                                             'color':'#111'}),
+                                    labels={migvar:'Number of migrants <br>(min-max normalization)',
+                                                "size": 12, 'family':'sans-serif','color':'#111'})
+
+    fig_choro = go.Figure(data=data_choropleth)
+
+    if compact:
+        return compact_frames(fig_choro.to_plotly_json())
+    return fig_choro
+
+
+######################################################Top-10 bars#######################################################
+
+def _hbar_template(color, title, reversed_range):
+    import plotly.graph_objs as go
+
+    trace = go.Bar(
+        x=[],
+        y=[],
+        orientation="h",
+        marker=dict(
+            color=color,
+            line=dict(
+                color=color,
+                width=10)
+        ),
+        width=.05
+    )
+
+    layout = dict(title=dict(text=title,
+                             x=.5, font={"size": 15, 'family':'sans-serif', 'color':'#111'}),
+                  xaxis=dict(title=dict(text="Number of migrants", font={"size": 13, 'family':'sans-serif', 'color':'#111'}),
+                             gridcolor="LightGrey",
+                             showline=True,
+                             range=[1, 0] if reversed_range else [0, 1],
+                             linecolor="rgb(89, 89, 89)",
+                             tickfont=dict(family="sans-serif", size=12, color='#111')),
+                  yaxis=dict(tickfont=dict(family="sans-serif", size=12, color='#111'),
+                             autorange="reversed"),
+                  paper_bgcolor="rgb(0,0,0,0)",
+                  plot_bgcolor="rgb(0,0,0,0)",
+                  )
+
+    return build_template([trace], layout)
+
+
+@template
+def hbar_templates():
+    return (_hbar_template('rgb(35,132,67)', "Migration inflow", reversed_range=False),
+            _hbar_template('rgb(203,24,29)', "Migration outflow", reversed_range=True))
+
+
+def hbar_figures(countries, year, top_n, in_names, in_values, out_names, out_values, max_in_out):
+    hbar_in_template, hbar_out_template = hbar_templates()
+
+    fig_bar = patch(hbar_in_template,
+                    traces=[dict(x=in_values, y=in_names)],
+                    layout={('title', 'text'): "Migration inflow - Top-" + str(top_n) + " countries<br>" + str(countries) + ", " + str(year),
+                            ('xaxis', 'range'): [0, max_in_out]})
+
+    fig_bar1 = patch(hbar_out_template,
+                     traces=[dict(x=out_values, y=out_names)],
+                     layout={('title', 'text'): "Migration outflow - Top-" + str(top_n) + " countries<br>" + str(countries) + ", " + str(year),
+                             ('xaxis', 'range'): [max_in_out, 0]})
+
+    return fig_bar, fig_bar1
+
+
+######################################################Corridor map######################################################
+# The top corridors of a year as arcs (plotly draws them as great circles) on the projection of the choropleth. The
+# arcs are split in classes by their share of the largest corridor, one line trace per class (the line width is
+# per trace) with a gap (NaN) between two arcs; an invisible marker at the middle of every arc carries its hover.
+
+# (minimum share of the largest corridor, line width)
+CORRIDOR_CLASSES = [(.5, 6), (.2, 4), (.05, 2.5), (0, 1.2)]
+
+
+@template
+def corridor_template():
+    import plotly.graph_objs as go
+
+    arcs = [go.Scattergeo(lon=[], lat=[], mode='lines', hoverinfo='skip', showlegend=False, opacity=.6,
+                          line=dict(color='rgb(35,132,67)', width=width))
+            for _, width in CORRIDOR_CLASSES]
+    middles = go.Scattergeo(lon=[], lat=[], text=[], mode='markers', hoverinfo='text', showlegend=False,
+                            marker=dict(size=8, color='rgb(35,132,67)', opacity=0))
+
+    layout = dict(title=dict(text='', x=.5, font={"size": 20, 'family':'sans-serif', 'color':'#111'}),
+                  geo=dict(projection=dict(type='natural earth'),
+                           showcountries=True,
+                           countrycolor='white',
+                           showland=True,
+                           landcolor='rgb(229,229,229)',
+                           showframe=False),
+                  margin=dict(l=0, r=0, b=0),
+                  paper_bgcolor="#ffffff")
+
+    return build_template(arcs + [middles], layout)
+
+
+def _great_circle_middles(lon1, lat1, lon2, lat2):
+    lon1, lat1, lon2, lat2 = (np.radians(v) for v in (lon1, lat1, lon2, lat2))
+    x = np.cos(lat1) * np.cos(lon1) + np.cos(lat2) * np.cos(lon2)
+    y = np.cos(lat1) * np.sin(lon1) + np.cos(lat2) * np.sin(lon2)
+    z = np.sin(lat1) + np.sin(lat2)
+    return np.degrees(np.arctan2(y, x)), np.degrees(np.arctan2(z, np.hypot(x, y)))
+
+
+def _arc_paths(lon1, lat1, lon2, lat2):
+    # [start, end, gap] per arc
+    gap = np.full(len(lon1), np.nan)
+    return np.column_stack([lon1, lon2, gap]).ravel(), np.column_stack([lat1, lat2, gap]).ravel()
+
+
+def corridor_figure(year, count, origins, destinations, origin_lonlat, destination_lonlat, values):
+    # origins/destinations: names, *_lonlat: (n, 2) arrays, values: the corridors' flows, largest first
+    template = corridor_template()
+    lon1, lat1 = origin_lonlat[:, 0], origin_lonlat[:, 1]
+    lon2, lat2 = destination_lonlat[:, 0], destination_lonlat[:, 1]
+
+    share = values / values[0] if len(values) else values
+    traces = []
+    upper = np.inf
+    for lower, _ in CORRIDOR_CLASSES:
+        arcs = (share >= lower) & (share < upper)
+        lon, lat = _arc_paths(lon1[arcs], lat1[arcs], lon2[arcs], lat2[arcs])
+        traces.append(dict(lon=lon, lat=lat))
+        upper = lower
+
+    middle_lon, middle_lat = _great_circle_middles(lon1, lat1, lon2, lat2)
+    text = ['{} \u2192 {}<br>{:,} migrants'.format(origin, destination, value)
+            for origin, destination, value in zip(origins, destinations, values.tolist())]
+    traces.append(dict(lon=middle_lon, lat=middle_lat, text=text))
+
+    return patch(template,
+                 traces=traces,
+                 layout={('title', 'text'): '<b>Top ' + str(count) + ' migration corridors, ' + str(year) + '</b>'})
+
+
+######################################################Indicator bars####################################################
+# (column in df_ind, chart title, y axis title, y axis range)
+
+INDICATORS = [
+    ('Deaths - Conflict and terrorism', "Deaths due to <br>conflicts and terrorism", "Number of deaths per 100000 inhab", [0, 765]),
+    ('GDP per capita', "GDP per capita", "US Dollars", [0, 130000]),
+    ('Political stability index (-2.5 weak; 2.5 strong)', "Political stability", "Stability index (-2.5 weak; 2.5 strong)", [-3.5, 2.5]),
+    ('Health spending per capita', 'Health spending per capita', "US Dollars", [0, 10250]),
+]
+
+# the quantiles of the statistics cube drawn as the percentile band of the indicator charts
+BAND = (.25, .75)
+
+LEGEND = dict(orientation='h',
+              yanchor='top',
+              xanchor='center',
+              y=-0.3,
+              x=0.5,
+              font=dict(family="sans-serif", size=12, color="#111")
+              )
+
+
+def _indicator_template(title, yaxis_title, yaxis_range, legend):
+    import plotly.graph_objs as go
+
+    bar = go.Bar(
+        x=[],
+        y=[],
+        orientation="v",
+        showlegend=False,
+        name='',
+        marker=dict(
+            color='rgb(239,225,156)',
+            line=dict(
+                color='rgb(217,240,163)',
+                width=12)
+        ),
+        width=.05
+    )
+
+    # only the last chart carries the legend entries for the global average, the percentile band and the region
+    if legend:
+        avg = go.Scatter(x=[], y=[], name='Global annual average', mode='lines', line=dict(color="#000000", width=2))
+    else:
+        avg = go.Scatter(x=[], y=[], showlegend=False, name='', mode='lines', line=dict(color="#000000", width=2))
+
+    # the band between the global BAND quantiles (filled down to its lower edge) and the mean of the country's region
+    band_low = go.Scatter(x=[], y=[], showlegend=False, name='', mode='lines', hoverinfo='skip', line=dict(width=0))
+    band_high = go.Scatter(x=[], y=[], showlegend=legend, name='Global {:.0f}th-{:.0f}th percentile'.format(BAND[0] * 100, BAND[1] * 100),
+                           mode='lines', hoverinfo='skip', line=dict(width=0), fill='tonexty',
+                           fillcolor='rgba(120,120,120,0.2)')
+    # (its legend entry is patched in with the region, see indicator_figure)
+    region = go.Scatter(x=[], y=[], showlegend=False, name='', mode='lines',
+                        line=dict(color="rgb(89, 89, 89)", width=2, dash='dot'))
+
+    layout = dict(title=dict(text=title,
+                             x=.5, font={"size": 15, 'family':'sans-serif', 'color': '#111'}),
+                  xaxis=dict(showline=True,
+                             linecolor="rgb(89, 89, 89)",
+                             tickmode='linear',
+                             tickangle=-90,
+                             tickfont=dict(family="sans-serif", size=12, color='#111')),
+                  yaxis=dict(title=dict(text=yaxis_title, font={"size": 13, 'family':'sans-serif', 'color': '#111'}),
+                             gridcolor="LightGrey",
+                             range=yaxis_range,
+                             tickfont=dict(family="sans-serif", size=12, color='#111')
+                             ),
+                  paper_bgcolor="#ffffff",
+                  plot_bgcolor="#ffffff",
+                  barmode='stack'
+                  )
+    if legend:
+        layout['legend'] = LEGEND
+
+    return build_template([bar, avg, band_low, band_high, region], layout)
+
+
+@template
+def indicator_templates():
+    return [_indicator_template(title, yaxis_title, yaxis_range, legend=(i == len(INDICATORS) - 1))
+            for i, (_, title, yaxis_title, yaxis_range) in enumerate(INDICATORS)]
+
+
+def rank_badge(text):
+    return dict(text=text, xref='paper', yref='paper', x=1, y=1, xanchor='right', yanchor='bottom', showarrow=False,
+                font=dict(family="sans-serif", size=11, color='#ffffff'), bgcolor='#155724', borderpad=3)
+
+
+def indicator_figure(i, years, values, avg_years, avg_values, band, region=None, rank=None):
+    # band: (years, low, high) of the column; region: (name, years, values); rank: (year, rank, countries ranked)
+    band_years, low, high = band
+    traces = [dict(x=years, y=values), dict(x=avg_years, y=avg_values), dict(x=band_years, y=low),
+              dict(x=band_years, y=high)]
+    if region is not None:
+        name, region_years, region_values = region
+        traces.append(dict(x=region_years, y=region_values, name=name + ' average',
+                           showlegend=(i == len(INDICATORS) - 1)))
+
+    annotations = []
+    if rank is not None and rank[1] > 0:
+        annotations.append(rank_badge('#{} of {} in {}'.format(rank[1], rank[2], rank[0])))
+
+    return patch(indicator_templates()[i], traces=traces, layout={('annotations',): annotations})
+
+
+######################################################Inflow vs Outflow line############################################
+
+@template
+def line_template():
+    import plotly.graph_objs as go
+
+    trace6 = go.Scatter(
+        x=[],
+        y=[],
+        name='Inflow',
+        mode='lines',
+        line=dict(color="#237924", width=2)
+    )
+
+    trace7 = go.Scatter(
+        x=[],
+        y=[],
+        name='Outflow',
+        mode='lines',
+        line=dict(color="#cc0000", width=2)
+    )
+
+    layout = dict(title=dict(text='Inflow vs Outlow',
+                             x=.5,
+                             font={"size": 15, 'family':'sans-serif', 'color': '#111'}),
+                  xaxis=dict(title=dict(text='Year',font={"size": 13, 'family':'sans-serif', 'color': '#111'}),
+                             gridcolor="LightGrey",
+                             range=[0, 1],
+                             showline=True,
+                             linewidth=1.1,
+                             linecolor="rgb(89, 89, 89)",
+                             tickfont=dict(family="sans-serif", size=12, color='#111'),
+                             tickmode='linear'),
+                  yaxis=dict(title=dict(text="Number of migrants",font={"size": 13, 'family':'sans-serif', 'color': '#111'}),
+                             gridcolor="LightGrey",
+                             range=[0, 1],
+                             tickfont=dict(family="sans-serif", size=12, color='#111')
+                             ),
+                  legend=LEGEND,
+                  paper_bgcolor = "#ffffff",
+                  plot_bgcolor="#ffffff"
+                  )
+
+    return build_template([trace6, trace7], layout)
+
+
+def line_figure(countries, year_aux, year, years, inflow, outflow, max_in_out):
+    return patch(line_template(),
+                 traces=[dict(x=years, y=inflow), dict(x=years, y=outflow)],
+                 layout={('title', 'text'): 'Inflow vs Outlow: ' + str(countries) + "<br> from " + str(year_aux) + " to " + str(year),
+                         ('xaxis', 'range'): [year_aux, year],
+                         ('yaxis', 'range'): [0, max_in_out]})
+
+
+######################################################Long-range series#################################################
+# Inflow and outflow of a country over any range of years, and one indicator on a second axis. The traces are WebGL
+# (Scattergl) and get at most the points the callback left after downsampling, so the chart costs the same to send
+# and to draw whatever the length of the range.
+
+@template
+def range_template():
+    import plotly.graph_objs as go
+
+    inflow = go.Scattergl(x=[], y=[], name='Inflow', mode='lines', line=dict(color="#237924", width=2))
+    outflow = go.Scattergl(x=[], y=[], name='Outflow', mode='lines', line=dict(color="#cc0000", width=2))
+    indicator = go.Scattergl(x=[], y=[], name='', mode='lines', yaxis='y2', line=dict(color="#000000", width=2, dash='dash'))
+
+    layout = dict(title=dict(text='',
+                             x=.5,
+                             font={"size": 15, 'family':'sans-serif', 'color': '#111'}),
+                  xaxis=dict(title=dict(text='Year',font={"size": 13, 'family':'sans-serif', 'color': '#111'}),
+                             gridcolor="LightGrey",
+                             showline=True,
+                             linewidth=1.1,
+                             linecolor="rgb(89, 89, 89)",
+                             tickfont=dict(family="sans-serif", size=12, color='#111')),
+                  yaxis=dict(title=dict(text="Number of migrants",font={"size": 13, 'family':'sans-serif', 'color': '#111'}),
+                             gridcolor="LightGrey",
+                             rangemode='tozero',
+                             tickfont=dict(family="sans-serif", size=12, color='#111')
+                             ),
+                  yaxis2=dict(title=dict(text='',font={"size": 13, 'family':'sans-serif', 'color': '#111'}),
+                              overlaying='y',
+                              side='right',
+                              showgrid=False,
+                              tickfont=dict(family="sans-serif", size=12, color='#111')
+                              ),
+                  legend=LEGEND,
+                  paper_bgcolor = "#ffffff",
+                  plot_bgcolor="#ffffff"
+                  )
+
+    return build_template([inflow, outflow, indicator], layout)
+
+
+def range_figure(countries, first, last, inflow, outflow, indicator, i):
+    # inflow, outflow, indicator: (x, y) of each trace, already downsampled
+    _, title, yaxis_title, _ = INDICATORS[i]
+    return patch(range_template(),
+                 traces=[dict(x=inflow[0], y=inflow[1]), dict(x=outflow[0], y=outflow[1]),
+                         dict(x=indicator[0], y=indicator[1], name=title.replace('<br>', ''))],
+                 layout={('title', 'text'): str(countries) + " from " + str(first) + " to " + str(last),
+                         ('xaxis', 'range'): [first, last],
+                         ('yaxis2', 'title', 'text'): yaxis_title})
+
+
+######################################################Country comparison################################################
+# One trace per compared country on the line chart: the template holds a single line trace that every country copies
+# (plotly's colorway tells them apart). The bars put the compared countries side by side for the selected year.
+
+@template
+def compare_line_template():
+    import plotly.graph_objs as go
+
+    line = go.Scatter(x=[], y=[], mode='lines+markers', line=dict(width=2), marker=dict(size=5))
+
+    layout = dict(title=dict(text='Net migration (Inflow - Outflow)',
+                             x=.5,
+                             font={"size": 15, 'family':'sans-serif', 'color': '#111'}),
+                  xaxis=dict(title=dict(text='Year',font={"size": 13, 'family':'sans-serif', 'color': '#111'}),
+                             gridcolor="LightGrey",
+                             showline=True,
+                             linewidth=1.1,
+                             linecolor="rgb(89, 89, 89)",
+                             tickfont=dict(family="sans-serif", size=12, color='#111'),
+                             tickmode='linear'),
+                  yaxis=dict(title=dict(text="Number of migrants",font={"size": 13, 'family':'sans-serif', 'color': '#111'}),
+                             gridcolor="LightGrey",
+                             zerolinecolor="rgb(89, 89, 89)",
+                             tickfont=dict(family="sans-serif", size=12, color='#111')
+                             ),
+                  legend=dict(font=dict(family="sans-serif", size=12, color='#111')),
+                  paper_bgcolor = "#ffffff",
+                  plot_bgcolor="#ffffff"
+                  )
+
+    return build_template([line], layout)
+
+
+def compare_line_figure(countries, years, values):
+    # values: (countries x years)
+    template = compare_line_template()
+    line = template['data'][0]
+    return {'data': [dict(line, x=years, y=row, name=country) for country, row in zip(countries, values)],
+            'layout': template['layout']}
+
+
+@template
+def compare_bar_templates():
+    import plotly.graph_objs as go
+
+    templates = []
+    for i, (_, title, yaxis_title, yaxis_range) in enumerate(INDICATORS):
+        bar = go.Bar(x=[], y=[], showlegend=False, name='', marker=dict(color='rgb(239,225,156)',
+                                                                        line=dict(color='rgb(217,240,163)', width=2)))
+        legend = i == len(INDICATORS) - 1
+        avg = go.Scatter(x=[], y=[], showlegend=legend, name='Global annual average' if legend else '', mode='lines',
+                         line=dict(color="#000000", width=2, dash='dash'))
+
+        layout = dict(title=dict(text=title,
+                                 x=.5, font={"size": 15, 'family':'sans-serif', 'color': '#111'}),
+                      xaxis=dict(showline=True,
+                                 linecolor="rgb(89, 89, 89)",
+                                 tickangle=-90,
+                                 tickfont=dict(family="sans-serif", size=12, color='#111')),
+                      yaxis=dict(title=dict(text=yaxis_title, font={"size": 13, 'family':'sans-serif', 'color': '#111'}),
+                                 gridcolor="LightGrey",
+                                 range=yaxis_range,
+                                 tickfont=dict(family="sans-serif", size=12, color='#111')
+                                 ),
+                      paper_bgcolor="#ffffff",
+                      plot_bgcolor="#ffffff"
+                      )
+        if legend:
+            layout['legend'] = LEGEND
+        templates.append(build_template([bar, avg], layout))
+    return templates
+
+
+def compare_bar_figure(i, year, countries, values, average):
+    return patch(compare_bar_templates()[i],
+                 traces=[dict(x=countries, y=values), dict(x=countries, y=[average] * len(countries))],
+                 layout={('title', 'text'): INDICATORS[i][1] + ' in ' + str(year)})
+
+
+def import_plotly():
+    # pays for the plotly imports ahead of the first figure (the initializer of the build pool processes)
+    import plotly.express
+    import plotly.graph_objs
+
+
+def build_templates():
+    # every template, by name
+    return {name: func() for name, func in TEMPLATES.items()}
+
+
+def load_templates(templates):
+    # use these instead of building the templates (as returned by build_templates)
+    _loaded.update(templates)
+    for func in TEMPLATES.values():
+        func.cache_clear()
@@ -0,0 +1,31 @@
+import gc
+
+
+
+# Import app.py (data, indexes, figure templates) once in the master and fork the workers from it, so the
+# workers share those pages copy-on-write instead of each one building its own copy.
+preload_app = True
+
+# gthread workers: while one thread builds a choropleth (over a second on a cold worker) the others keep answering
+# the lookups; with sync workers those queue behind the build (see benchmarks/bench_concurrency.py)
+threads = 4
+
+
+def pre_fork(server, worker):
+    # figure templates are built lazily; build them here once so the workers share them too
+    import figures
+    figures.build_templates()
+
+    # the collector would otherwise write to the preloaded objects and un-share their pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # start the worker's build pool (MIGRATION_POOL_WORKERS) now, not on its first choropleth request
+    import app
+    if app.build_pool is not None:
+        app.build_pool.start()
+
+    # and its refresh watcher (MIGRATION_REFRESH_INTERVAL): threads are not inherited from the master
+    if app.refresh_interval is not None:
+        app.snapshots.watch(app.refresh_interval)
@@ -0,0 +1,360 @@
+import warnings
+
+import numpy as np
+
+
+######################################################Normalization#####################################################
+
+def min_max_scale(x):
+    # per column min-max normalization to [0, 1], the same arithmetic as sklearn's MinMaxScaler
+    # (constant columns map to 0) without importing sklearn for one call
+    data_min = x.min(axis=0)
+    data_range = x.max(axis=0) - data_min
+    scale = 1.0 / np.where(data_range == 0, 1.0, data_range)
+    return x * scale + (0 - data_min * scale)
+
+
+######################################################Flow tensor#######################################################
+# The bilateral rows as a sparse destination x origin x year tensor: one CSR matrix per year (destinations as rows,
+# origins as columns), all stored in flat arrays. The entries of a (destination, year) row are one slice, so the
+# top origins and the KPI totals of a selection cost the same whatever the total row count; a second ordering
+# of the entries (the CSC of every year) slices by origin, and every year is one contiguous block of entries.
+# Within a row the entries keep the workbook's row order, which breaks the ties of the top origins: a deliberate,
+# deterministic tie-break, not the old one (the baseline's sort_values was not stable, so an origin tied at the cut
+# could differ from what it showed).
+
+EMPTY_TOTALS = (0, 0, 0)
+
+NO_NAMES = np.empty(0, dtype=object)
+NO_VALUES = np.empty(0, dtype=np.int64)
+
+FLOW_VALUES = ['Inflow', 'Outflow', 'Net-Migration']
+
+
+def _rank(names, origins, values, k):
+    # the origins of the k largest positive values, largest first; long rows are cut with a partition first
+    positive = np.flatnonzero(values > 0)
+    if 4 * k < len(positive):
+        # the k-th largest value is the cut; of the values tied on it the first in row order are kept
+        cut = -np.partition(-values[positive], k - 1)[k - 1]
+        above = positive[values[positive] > cut]
+        positive = np.sort(np.r_[above, positive[values[positive] == cut][:k - len(above)]])
+    positive = positive[np.argsort(-values[positive], kind='stable')][:k]
+    return names[origins[positive]], values[positive]
+
+
+def _pointers(keys, size):
+    # CSR row pointers of the sorted `keys`: the entries of row r are [pointers[r], pointers[r + 1])
+    return np.searchsorted(keys, np.arange(size + 1)).astype(np.int64)
+
+
+class FlowTensor:
+
+    def __init__(self, df):
+        destination = df['Country'].astype('category')
+        origin = df['Country of origin'].astype('category')
+        self.destinations = np.asarray(destination.cat.categories.astype(str), dtype=object)
+        self.origins = np.asarray(origin.cat.categories, dtype=object)
+        self.years = np.unique(df['Year'].values).astype(np.int64)
+        self.destination_rows = {name: i for i, name in enumerate(self.destinations)}
+        self.origin_columns = {str(name): i for i, name in enumerate(self.origins)}
+        self.year_index = {int(year): i for i, year in enumerate(self.years)}
+
+        # rows whose destination or origin is missing are not flows between two countries
+        known = (destination.cat.codes.values >= 0) & (origin.cat.codes.values >= 0)
+        destination_codes = destination.cat.codes.values[known].astype(np.int64)
+        origin_codes = origin.cat.codes.values[known].astype(np.int64)
+        year_codes = np.searchsorted(self.years, df['Year'].values[known])
+
+        # entries sorted by (year, destination), stable so a row keeps the workbook order
+        n_destinations, n_origins = len(self.destinations), len(self.origins)
+        rows = year_codes * n_destinations + destination_codes
+        order = np.argsort(rows, kind='stable')
+        self.indptr = _pointers(rows[order], len(self.years) * n_destinations)
+        self.indices = origin_codes[order].astype(np.int32)
+        self.entry_destinations = destination_codes[order].astype(np.int32)
+        self.values = {column: np.asarray(df[column].values)[known][order] for column in FLOW_VALUES}
+
+        # the same entries by (year, origin)
+        columns = year_codes[order] * n_origins + origin_codes[order]
+        self.by_origin = np.argsort(columns, kind='stable')
+        self.origin_indptr = _pointers(columns[self.by_origin], len(self.years) * n_origins)
+
+        # per row sums (the text boxes), as differences of running sums
+        self.row_totals = np.stack([np.diff(np.r_[0, np.cumsum(self.values[column], dtype=np.int64)][self.indptr])
+                                    for column in FLOW_VALUES], axis=1)
+        self.row_present = np.diff(self.indptr) > 0
+
+    def _row(self, country, year):
+        destination = self.destination_rows.get(country)
+        year = self.year_index.get(year)
+        if destination is None or year is None:
+            return None
+        return year * len(self.destinations) + destination
+
+    def destination_slice(self, country, year):
+        # (origin codes, {column: values}) of the flows into `country` in `year`
+        row = self._row(country, year)
+        if row is None:
+            return self.indices[:0], {column: values[:0] for column, values in self.values.items()}
+        entries = slice(self.indptr[row], self.indptr[row + 1])
+        return self.indices[entries], {column: values[entries] for column, values in self.values.items()}
+
+    def origin_slice(self, origin, year):
+        # (destination codes, {column: values}) of the flows from `origin` in `year`
+        column = self.origin_columns.get(origin)
+        year = self.year_index.get(year)
+        if column is None or year is None:
+            entries = self.by_origin[:0]
+        else:
+            start = year * len(self.origins) + column
+            entries = self.by_origin[self.origin_indptr[start]:self.origin_indptr[start + 1]]
+        return self.entry_destinations[entries], {column: values[entries] for column, values in self.values.items()}
+
+    def year_slice(self, year):
+        # (destination codes, origin codes, {column: values}) of every flow in `year`, in COO form
+        year = self.year_index.get(year)
+        if year is None:
+            entries = slice(0, 0)
+        else:
+            n_destinations = len(self.destinations)
+            entries = slice(self.indptr[year * n_destinations], self.indptr[(year + 1) * n_destinations])
+        return (self.entry_destinations[entries], self.indices[entries],
+                {column: values[entries] for column, values in self.values.items()})
+
+    def top(self, country, year, column, k=10):
+        # the k origins with the largest positive `column` into `country` in `year`, largest first
+        origins, values = self.destination_slice(country, year)
+        if not len(origins):
+            return NO_NAMES, NO_VALUES
+        return _rank(self.origins, origins, values[column], k)
+
+    def totals(self, country, year):
+        # (Inflow, Outflow, Net-Migration) summed over the origins
+        row = self._row(country, year)
+        if row is None or not self.row_present[row]:
+            return EMPTY_TOTALS
+        return tuple(int(total) for total in self.row_totals[row])
+
+
+def summary_table(tensor):
+    # the totals as plain JSON for the browser: {'years': [...], 'totals': {country: [[in, out, net] or None per year]}}
+    present = tensor.row_present.reshape(len(tensor.years), len(tensor.destinations))
+    totals = tensor.row_totals.reshape(len(tensor.years), len(tensor.destinations), len(FLOW_VALUES)).tolist()
+    years = [i for i in range(len(tensor.years)) if present[i].any()]
+    countries = sorted((name, i) for i, name in enumerate(tensor.destinations) if present[:, i].any())
+    return {'years': [int(tensor.years[i]) for i in years],
+            'totals': {name: [totals[year][i] if present[year, i] else None for year in years]
+                       for name, i in countries}}
+
+
+######################################################Corridors#########################################################
+# Per year, the corridors (origin -> destination entries of the flow tensor) ranked by their flow, largest first,
+# so the top N corridors of a year are the first N of its block instead of a sort of every row per request.
+
+class CorridorIndex:
+
+    def __init__(self, tensor, column='Inflow', keep=None):
+        # keep: optional mask over the tensor entries (e.g. the corridors whose two ends can be drawn)
+        self.tensor = tensor
+        self.column = column
+
+        values = tensor.values[column]
+        n_destinations = len(tensor.destinations)
+        entry_years = np.repeat(np.arange(len(tensor.years)),
+                                np.diff(tensor.indptr[::n_destinations]))
+        ranked = values > 0
+        if keep is not None:
+            ranked &= keep
+        entries = np.flatnonzero(ranked)
+        # by year, then by decreasing value (stable, so ties keep the tensor order)
+        self.ranked = entries[np.lexsort((-values[entries], entry_years[entries]))]
+        self.indptr = np.searchsorted(entry_years[self.ranked], np.arange(len(tensor.years) + 1))
+
+    def __len__(self):
+        return len(self.ranked)
+
+    def count(self, year):
+        year = self.tensor.year_index.get(year)
+        return 0 if year is None else int(self.indptr[year + 1] - self.indptr[year])
+
+    def top(self, year, n):
+        # (origin codes, destination codes, values) of the n largest corridors of `year`
+        tensor = self.tensor
+        year = tensor.year_index.get(year)
+        if year is None:
+            entries = self.ranked[:0]
+        else:
+            entries = self.ranked[self.indptr[year]:min(self.indptr[year] + n, self.indptr[year + 1])]
+        return tensor.indices[entries], tensor.entry_destinations[entries], tensor.values[self.column][entries]
+
+
+######################################################Indicator cube####################################################
+# df_ind as a dense country x year x column array with a country -> row lookup, so the year window of a
+# selection is a slice of one row. (Country, Year) pairs missing from df_ind are masked out by `present`.
+
+class IndicatorCube:
+
+    def __init__(self, df_ind, columns, averages=False):
+        country = df_ind['Country'].astype('category')
+        self.countries = [str(c) for c in country.cat.categories]
+        self.country_rows = {c: i for i, c in enumerate(self.countries)}
+        self.years = np.unique(df_ind['Year'].values)
+        self.columns = list(columns)
+
+        dtype = np.result_type(*[df_ind[c].dtype for c in self.columns])
+        rows = country.cat.codes.values
+        cols = np.searchsorted(self.years, df_ind['Year'].values)
+
+        self.values = np.full((len(self.countries), len(self.years), len(self.columns)),
+                              np.nan if dtype.kind == 'f' else 0, dtype=dtype)
+        self.values[rows, cols] = df_ind[self.columns].values
+        self.present = np.zeros((len(self.countries), len(self.years)), dtype=bool)
+        self.present[rows, cols] = True
+
+        # global annual average per column (the former df_avg), computed once at build time
+        self.averages = None
+        if averages:
+            self.averages = df_ind.groupby('Year')[self.columns].mean().reindex(self.years).values
+
+    def extended(self, new_rows, df_ind):
+        # a new cube with new_rows (new countries and/or years of df_ind) filled in; the existing block is
+        # copied as is and the averages are recomputed only for the years new_rows touch
+        cube = IndicatorCube.__new__(IndicatorCube)
+        cube.columns = self.columns
+
+        new_countries = sorted(set(new_rows['Country'].astype(str)) - set(self.country_rows))
+        cube.countries = self.countries + new_countries
+        cube.country_rows = {c: i for i, c in enumerate(cube.countries)}
+        cube.years = np.union1d(self.years, new_rows['Year'].values)
+
+        dtype = np.result_type(self.values.dtype, *[new_rows[c].dtype for c in self.columns])
+        old_cols = np.searchsorted(cube.years, self.years)
+        cube.values = np.full((len(cube.countries), len(cube.years), len(cube.columns)),
+                              np.nan if dtype.kind == 'f' else 0, dtype=dtype)
+        cube.values[:len(self.countries), old_cols] = self.values
+        cube.present = np.zeros((len(cube.countries), len(cube.years)), dtype=bool)
+        cube.present[:len(self.countries), old_cols] = self.present
+
+        rows = [cube.country_rows[c] for c in new_rows['Country'].astype(str)]
+        cols = np.searchsorted(cube.years, new_rows['Year'].values)
+        cube.values[rows, cols] = new_rows[cube.columns].values
+        cube.present[rows, cols] = True
+
+        cube.averages = None
+        if self.averages is not None:
+            cube.averages = np.full((len(cube.years), len(cube.columns)), np.nan)
+            cube.averages[old_cols] = self.averages
+            touched = np.unique(new_rows['Year'].values)
+            touched_rows = df_ind[df_ind['Year'].isin(touched)]
+            cube.averages[np.searchsorted(cube.years, touched)] = \
+                touched_rows.groupby('Year')[cube.columns].mean().reindex(touched).values
+
+        return cube
+
+    def year_slice(self, first, last):
+        return slice(np.searchsorted(self.years, first), np.searchsorted(self.years, last, side='right'))
+
+    def window(self, country, first, last):
+        # years and a (years x columns) view of one country's rows between first and last, inclusive
+        row = self.country_rows.get(country)
+        years = self.year_slice(first, last)
+        if row is None:
+            return self.years[:0], self.values[0, :0]
+
+        present = self.present[row, years]
+        if present.all():
+            return self.years[years], self.values[row, years]
+        return self.years[years][present], self.values[row, years][present]
+
+    def gather(self, countries, first, last):
+        # the (countries x years x columns) block of several countries at once: one fancy index over the cube,
+        # cells without a row come back as NaN and countries the cube doesn't know are left out
+        rows = np.array([self.country_rows[c] for c in countries if c in self.country_rows], dtype=np.intp)
+        years = self.year_slice(first, last)
+
+        block = self.values[rows, years].astype(float)
+        block[~self.present[rows, years]] = np.nan
+        return [self.countries[row] for row in rows], self.years[years], block
+
+
+
+######################################################Statistics cube###################################################
+# Per year and column statistics of an IndicatorCube over its countries, computed once per snapshot: the mean (the
+# cube's global annual averages, the same numbers df_avg had), the QUANTILES, how many countries have a value, every
+# country's rank (1 = highest value, ties share the best rank, 0 = no value) and, given a country -> region mapping,
+# the mean of every region. The callbacks read slices of these arrays, nothing is grouped at request time.
+
+QUANTILES = (.1, .25, .5, .75, .9)
+
+
+class StatisticsCube:
+
+    def __init__(self, cube, quantiles=QUANTILES, regions=None):
+        self.countries = cube.countries
+        self.country_rows = cube.country_rows
+        self.years = cube.years
+        self.columns = cube.columns
+        self.quantiles = tuple(quantiles)
+
+        values = np.where(cube.present[:, :, None], cube.values, np.nan).astype(float)
+        valid = ~np.isnan(values)
+
+        self.mean = cube.averages if cube.averages is not None else self._nanmean(values)
+        self.count = valid.sum(axis=0).astype(np.int16)
+        with warnings.catch_warnings():
+            # years where a column has no value at all
+            warnings.simplefilter('ignore', RuntimeWarning)
+            self.quantile_values = np.nanquantile(values, self.quantiles, axis=0)
+
+        self.rank = np.zeros(values.shape, dtype=np.int16)
+        for year in range(len(self.years)):
+            for column in range(len(self.columns)):
+                rows = np.flatnonzero(valid[:, year, column])
+                descending = np.sort(-values[rows, year, column])
+                self.rank[rows, year, column] = np.searchsorted(descending, -values[rows, year, column]) + 1
+
+        # region rollups: the region of every country (-1 without one) and a (regions x years x columns) mean
+        regions = regions or {}
+        self.regions = sorted(set(regions[c] for c in self.countries if c in regions))
+        region_rows = {region: i for i, region in enumerate(self.regions)}
+        self.country_region = np.array([region_rows.get(regions.get(c), -1) for c in self.countries], dtype=np.int16)
+        self.region_mean = np.full((len(self.regions),) + values.shape[1:], np.nan)
+        for i in range(len(self.regions)):
+            self.region_mean[i] = self._nanmean(values[self.country_region == i])
+
+    @staticmethod
+    def _nanmean(values):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return np.nanmean(values, axis=0)
+
+    def year_slice(self, first, last):
+        return slice(np.searchsorted(self.years, first), np.searchsorted(self.years, last, side='right'))
+
+    def mean_window(self, first, last):
+        years = self.year_slice(first, last)
+        return self.years[years], self.mean[years]
+
+    def band(self, first, last, low, high):
+        # years and the (years x columns) low and high quantiles between first and last
+        years = self.year_slice(first, last)
+        return (self.years[years], self.quantile_values[self.quantiles.index(low), years],
+                self.quantile_values[self.quantiles.index(high), years])
+
+    def ranking(self, country, year):
+        # per column rank of the country in the year and how many countries were ranked, None if either is unknown
+        row = self.country_rows.get(country)
+        column = np.searchsorted(self.years, year)
+        if row is None or column == len(self.years) or self.years[column] != year:
+            return None
+        return self.rank[row, column], self.count[column]
+
+    def region_window(self, country, first, last):
+        # the country's region, the years and the (years x columns) region mean, None without a region
+        row = self.country_rows.get(country)
+        if row is None or self.country_region[row] < 0:
+            return None
+        years = self.year_slice(first, last)
+        region = self.country_region[row]
+        return self.regions[region], self.years[years], self.region_mean[region, years]
@@ -0,0 +1,164 @@
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from dash._utils import split_callback_id
+
+import serving
+
+
+
+######################################################LRU cache#########################################################
+# Callback responses are pure functions of (country, year), so the encoded JSON each callback returns is
+# memoized per (callback id, input values). An optional SharedStore behind the LRU lets all the gunicorn
+# workers of a host reuse each other's results.
+
+class LRUCache:
+
+    def __init__(self, maxsize=1024, shared=None):
+        self.maxsize = maxsize
+        self.shared = shared
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.flights = serving.SingleFlight()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+        if self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                with self.lock:
+                    self.shared_hits += 1
+                self._put(key, value)
+                return value
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value, share=True):
+        self._put(key, value)
+        if share and self.shared is not None:
+            self.shared.set(key, value)
+
+    def _put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        # a miss is computed once even when several threads ask for the key at the same time
+        value = self.get(key)
+        if value is None:
+            value = self.flights.do(key, lambda: self._compute(key, compute))
+        return value
+
+    def _compute(self, key, compute):
+        value = compute()
+        self.set(key, value)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.entries), 'maxsize': self.maxsize, 'hits': self.hits,
+                    'shared_hits': self.shared_hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'coalesced': self.flights.coalesced}
+
+
+######################################################Shared store######################################################
+
+class SharedStore:
+    # a SQLite file shared by the worker processes; one connection per thread and process
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self._connection().execute('CREATE TABLE IF NOT EXISTS memo (key TEXT PRIMARY KEY, value TEXT)')
+
+    def _connection(self):
+        # a connection opened before gunicorn forks must not be reused by the children
+        pid, connection = getattr(self.local, 'connection', (None, None))
+        if pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self.local.connection = (os.getpid(), connection)
+        return connection
+
+    def get(self, key):
+        row = self._connection().execute('SELECT value FROM memo WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value):
+        self._connection().execute('INSERT OR REPLACE INTO memo VALUES (?, ?)', (key, value))
+
+    def clear(self):
+        self._connection().execute('DELETE FROM memo')
+
+
+def cache_from_env():
+    shared_path = os.environ.get('MIGRATION_SHARED_CACHE')
+    shared = SharedStore(shared_path) if shared_path else None
+    return LRUCache(int(os.environ.get('MIGRATION_MEMO_SIZE', 1024)), shared)
+
+
+######################################################Memoized callbacks################################################
+
+def memoize_callbacks(app, cache, inputs, valid_args=None, namespace=None):
+    # wrap every registered callback whose inputs are exactly `inputs`; only argument tuples in
+    # valid_args() are memoized, so arbitrary posted values can't fill the caches, and namespace()
+    # prefixes every key (both are called per request, so they can follow data refreshes)
+    memoized = []
+    for callback_id, entry in app.callback_map.items():
+        if 'callback' not in entry or [i['id'] for i in entry['inputs']] != list(inputs) or entry['state']:
+            continue
+        entry['callback'] = _memoized(callback_id, entry['callback'], cache, valid_args, namespace)
+        memoized.append(callback_id)
+    return memoized
+
+
+def _memoized(callback_id, dispatch, cache, valid_args, namespace):
+
+    def memoized(*args, outputs_list):
+        if valid_args is not None and args not in valid_args():
+            return dispatch(*args, outputs_list=outputs_list)
+
+        key = serving.callback_key(callback_id, args)
+        if namespace is not None:
+            key = namespace() + ':' + key
+        return cache.get_or_compute(key, lambda: dispatch(*args, outputs_list=outputs_list))
+
+    memoized.__wrapped__ = dispatch.__wrapped__
+    memoized.dispatch = dispatch
+    return memoized
+
+
+def warm_up(app, cache, callback_ids, args_list):
+    # run every callback over the whole input grid once, e.g. at boot. Without a shared store the LRU is grown to
+    # hold every response, it would evict most of the warm-up before the first request otherwise
+    if cache.shared is None:
+        cache.maxsize = max(cache.maxsize, len(callback_ids) * len(args_list))
+    for callback_id in callback_ids:
+        callback = app.callback_map[callback_id]['callback']
+        outputs_list = split_callback_id(callback_id)
+        for args in args_list:
+            callback(*args, outputs_list=outputs_list)
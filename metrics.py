@@ -0,0 +1,194 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+
+######################################################Phases############################################################
+# The callbacks mark their data lookups and figure building with `with phase(...)`; the time is attributed to the
+# instrumented callback running on the same thread, and is a no-op when instrumentation is off.
+
+_local = threading.local()
+
+
+@contextmanager
+def phase(name):
+    timings = getattr(_local, 'timings', None)
+    if timings is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
+######################################################Metrics###########################################################
+# Prometheus histograms per callback: wall time, wall time by phase and response size (the histogram counts are the
+# request counts). prometheus_client is only imported when the instrumentation is enabled (MIGRATION_METRICS).
+
+LATENCY_BUCKETS = (.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (1e3, 5e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7)
+
+
+class CallbackMetrics:
+
+    def __init__(self, registry=None):
+        from prometheus_client import REGISTRY, Counter, Histogram
+
+        registry = registry or REGISTRY
+        self.seconds = Histogram('migration_callback_seconds', 'Wall time of a callback request',
+                                 ['callback'], buckets=LATENCY_BUCKETS, registry=registry)
+        self.phase_seconds = Histogram('migration_callback_phase_seconds',
+                                       'Wall time of a callback request by phase (data, figure, serialize, cache)',
+                                       ['callback', 'phase'], buckets=LATENCY_BUCKETS, registry=registry)
+        self.response_bytes = Histogram('migration_callback_response_bytes', 'Size of a callback response',
+                                        ['callback'], buckets=SIZE_BUCKETS, registry=registry)
+        self.errors = Counter('migration_callback_errors', 'Callback requests that raised',
+                              ['callback'], registry=registry)
+
+    def observe(self, callback, seconds, timings, size):
+        self.seconds.labels(callback).observe(seconds)
+        self.response_bytes.labels(callback).observe(size)
+
+        if timings:
+            # the callback body ran: what its phases don't cover is dash's JSON encoding and dispatch
+            timings['serialize'] = timings.get('serialize', 0.0) + max(seconds - sum(timings.values()), 0.0)
+        else:
+            # answered by the memo LRU or an export artifact
+            timings = {'cache': seconds}
+        for name, value in timings.items():
+            self.phase_seconds.labels(callback, name).observe(value)
+
+
+def metrics_response():
+    # the body and content type of /metrics; with PROMETHEUS_MULTIPROC_DIR set (several gunicorn workers)
+    # the samples of all the workers are aggregated
+    from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest
+
+    registry = REGISTRY
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+######################################################Instrumented callbacks############################################
+
+def instrument_callbacks(app, metrics, profiler=None):
+    # wrap every server side callback; install it last, so memo and artifact hits are measured too
+    instrumented = []
+    for callback_id, entry in app.callback_map.items():
+        if 'callback' in entry:
+            entry['callback'] = _instrumented(entry['callback'], metrics, profiler)
+            instrumented.append(callback_id)
+    return instrumented
+
+
+def _instrumented(callback, metrics, profiler):
+    name = callback.__wrapped__.__name__
+
+    def instrumented(*args, outputs_list):
+        _local.timings = timings = {}
+        stacks = profiler.start() if profiler is not None else None
+        start = time.perf_counter()
+        try:
+            response = callback(*args, outputs_list=outputs_list)
+        except Exception:
+            metrics.errors.labels(name).inc()
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            _local.timings = None
+            if profiler is not None:
+                profiler.stop(stacks, name, elapsed)
+
+        metrics.observe(name, elapsed, timings, len(response))
+        return response
+
+    instrumented.__wrapped__ = callback.__wrapped__
+    instrumented.dispatch = getattr(callback, 'dispatch', callback)
+    return instrumented
+
+
+######################################################Sampling profiler#################################################
+# Samples the stacks of the threads running callbacks every `interval` seconds. The samples of a request slower
+# than `threshold` are written to `directory` as folded stacks ("frame;frame;frame count" per line, the input of
+# flamegraph.pl and speedscope); faster requests are discarded.
+
+def _folded(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class SamplingProfiler:
+
+    def __init__(self, directory, threshold, interval=0.005):
+        self.directory = directory
+        self.threshold = threshold
+        self.interval = interval
+        # thread id -> folded stack counts of the request it is running
+        self.active = {}
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def _ensure_sampler(self):
+        # threads don't survive a fork: every worker starts its own sampler on its first request
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                threading.Thread(target=self._sample, name='migration-profiler', daemon=True).start()
+
+    def _sample(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                if not self.active:
+                    continue
+                frames = sys._current_frames()
+                for ident, stacks in self.active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        stacks[_folded(frame)] += 1
+
+    def start(self):
+        self._ensure_sampler()
+        stacks = Counter()
+        with self.lock:
+            self.active[threading.get_ident()] = stacks
+        return stacks
+
+    def stop(self, stacks, name, elapsed):
+        with self.lock:
+            self.active.pop(threading.get_ident(), None)
+        if elapsed >= self.threshold and stacks:
+            self.dump(stacks, name, elapsed)
+
+    def dump(self, stacks, name, elapsed):
+        os.makedirs(self.directory, exist_ok=True)
+        file_name = '{}-{}-{}-{:.0f}ms.folded'.format(time.strftime('%Y%m%d-%H%M%S'), os.getpid(), name, elapsed * 1000)
+        with open(os.path.join(self.directory, file_name), 'w') as f:
+            for stack, count in stacks.most_common():
+                f.write('{} {}\n'.format(stack, count))
+
+
+def profiler_from_env():
+    # MIGRATION_PROFILE_SLOW_MS enables the profiler for requests slower than that many milliseconds
+    threshold = os.environ.get('MIGRATION_PROFILE_SLOW_MS')
+    if not threshold:
+        return None
+    return SamplingProfiler(os.environ.get('MIGRATION_PROFILE_DIR', 'profiles'),
+                            float(threshold) / 1000,
+                            float(os.environ.get('MIGRATION_PROFILE_INTERVAL_MS', 5)) / 1000)
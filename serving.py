@@ -0,0 +1,196 @@
+import functools
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import plotly
+
+import metrics
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+######################################################Encoding##########################################################
+
+_plotly_encoder = plotly.utils.PlotlyJSONEncoder()
+
+
+def encode(value):
+    # orjson when it is installed, several times faster and compact; it writes NaN as null like dash's encoder, and
+    # what it can't serialize itself (object and strided numpy arrays, plotly objects) goes through plotly's rules
+    if orjson is not None:
+        return orjson.dumps(value, default=_plotly_encoder.default, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+    # the same encoder dash uses for callback responses
+    return json.dumps(value, cls=plotly.utils.PlotlyJSONEncoder)
+
+
+def callback_key(callback_id, args):
+    # identifies one callback response, used by the memo caches and the export artifact
+    return callback_id + json.dumps(list(args))
+
+
+def response_json(outputs_list, encoded_values):
+    # the body dash's add_context builds, assembled from values that are already JSON
+    if isinstance(outputs_list, dict):
+        outputs_list, encoded_values = [outputs_list], [encoded_values]
+
+    components = {}
+    for spec, value in zip(outputs_list, encoded_values):
+        components.setdefault(spec['id'], []).append(json.dumps(spec['property']) + ':' + value)
+
+    body = ','.join(json.dumps(id_) + ':{' + ','.join(props) + '}' for id_, props in components.items())
+    return '{"response":{' + body + '},"multi":true}'
+
+
+######################################################Encoded callbacks#################################################
+
+def encoded_callback(app, *args, **kwargs):
+    # like app.callback, for functions that return already encoded JSON (one string per output):
+    # the callback is registered as usual, but dispatch skips dash's json.dumps of the figures
+    register = app.callback(*args, **kwargs)
+
+    def wrap(func):
+        add_context = register(func)
+        callback_id = next(k for k, v in app.callback_map.items() if v.get('callback') is add_context)
+
+        def dispatch(*args, outputs_list):
+            return response_json(outputs_list, func(*args))
+
+        dispatch.__wrapped__ = func
+        app.callback_map[callback_id]['callback'] = dispatch
+        return dispatch
+
+    return wrap
+
+
+def encoded(func):
+    # for encoded_callback: func's output values encoded one by one with encode()
+    @functools.wraps(func)
+    def encode_outputs(*args):
+        values = func(*args)
+        with metrics.phase('serialize'):
+            return [encode(value) for value in values]
+
+    return encode_outputs
+
+
+######################################################Single flight#####################################################
+# Concurrent requests for the same key share one computation: the first caller computes, the others wait for its
+# result instead of computing it again (e.g. several users landing on the same country and year at once).
+
+class SingleFlight:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.coalesced = 0
+
+    def do(self, key, compute):
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            future.set_result(compute())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self.lock:
+                del self.calls[key]
+        return future.result()
+
+
+######################################################Build pool########################################################
+# CPU-heavy figure builds (px.choropleth, over a second each) can run in a bounded process pool: the build and its
+# encoding happen in a pool process, so the worker's other threads keep answering lookups meanwhile instead of
+# waiting for the GIL. build_pool.run(func, *args) returns encode(func(*args)); func and args must pickle.
+
+def build_encoded(func, *args):
+    return encode(func(*args))
+
+
+class BuildPool:
+
+    def __init__(self, workers, initializer=None):
+        self.workers = workers
+        self.initializer = initializer
+        self.lock = threading.Lock()
+        self.executor = None
+        self.pid = None
+
+    def _executor(self):
+        # one pool per worker process, started on first use (never inherited through gunicorn's fork); spawned,
+        # since forking a process that runs threads can deadlock the child
+        with self.lock:
+            if self.pid != os.getpid():
+                self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                                    initializer=self.initializer)
+                self.pid = os.getpid()
+            return self.executor
+
+    def start(self):
+        # start the processes (and their initializer) now rather than on the first build
+        executor = self._executor()
+        for _ in range(self.workers):
+            executor.submit(os.getpid)
+
+    def run(self, func, *args):
+        return self._executor().submit(build_encoded, func, *args).result()
+
+
+######################################################Encoded cache#####################################################
+
+class EncodedCache:
+    # key -> encoded JSON of build(key), built on first use (or by warm) and kept until invalidate; with a BuildPool
+    # the builds run in it (build must then pickle, e.g. a functools.partial of a module level function)
+
+    def __init__(self, build, pool=None):
+        self.build = build
+        self.pool = pool
+        self.encoded = {}
+        self.flights = SingleFlight()
+
+    def get(self, key):
+        try:
+            return self.encoded[key]
+        except KeyError:
+            pass
+
+        # concurrent requests for a key being built wait for that build, other keys build in parallel
+        return self.flights.do(key, lambda: self._build(key))
+
+    def _build(self, key):
+        if key in self.encoded:
+            return self.encoded[key]
+
+        if self.pool is not None:
+            with metrics.phase('figure'):
+                encoded = self.pool.run(self.build, key)
+        else:
+            with metrics.phase('figure'):
+                value = self.build(key)
+            with metrics.phase('serialize'):
+                encoded = encode(value)
+
+        self.encoded[key] = encoded
+        return encoded
+
+    def warm(self, keys):
+        for key in keys:
+            self.get(key)
+
+    def invalidate(self):
+        # call after the underlying data is reloaded, the next get rebuilds from it
+        self.encoded = {}
@@ -0,0 +1,351 @@
+import functools
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import data
+import figures
+import indexes
+import serving
+import validation
+
+
+
+######################################################Aggregates########################################################
+
+FLOW_COLUMNS = validation.FLOW_COLUMNS
+NORM_COLUMNS = ['norm Inflow', 'norm Outflow', 'norm Net']
+
+# the columns identifying a row of each workbook (unique once validated, see validation.py)
+MIGRATION_KEYS = validation.MIGRATION_KEYS
+INDICATOR_KEYS = validation.INDICATOR_KEYS
+
+
+# threads summing the rows in aggregate_flows
+AGGREGATE_WORKERS = int(os.environ.get('MIGRATION_AGGREGATE_WORKERS', 1))
+
+
+def _block_sums(key, values, size):
+    # row count and per column sums of every key, np.bincount releases the GIL
+    return np.stack([np.bincount(key, minlength=size)] +
+                    [np.bincount(key, weights=column, minlength=size) for column in values])
+
+
+def aggregate_flows(df, workers=None):
+    # (Country, Year) -> summed flows, sorted by country and year: one pass of np.bincount per column over a dense
+    # (country, year) key, without a groupby or any intermediate frame. With several workers the rows are split in
+    # contiguous blocks (the workbook rows come country after country) summed in threads, then added up.
+    workers = workers or AGGREGATE_WORKERS
+    country = df['Country'].astype('category')
+    names = np.asarray(country.cat.categories.astype(str), dtype=object)
+    order = np.argsort(names, kind='stable')
+    rank = np.empty(len(names), dtype=np.int64)
+    rank[order] = np.arange(len(names))
+
+    codes = np.asarray(country.cat.codes)
+    years = df['Year'].values.astype(np.int64)
+    values = [df[column].values for column in FLOW_COLUMNS]
+    if (codes < 0).any():
+        known = codes >= 0
+        codes, years, values = codes[known], years[known], [column[known] for column in values]
+
+    first_year = years.min() if len(years) else 0
+    n_years = int(years.max() - first_year + 1) if len(years) else 1
+    key = rank[codes] * n_years + (years - first_year)
+    size = len(names) * n_years
+
+    if workers > 1 and len(key) >= 2 * workers:
+        bounds = np.linspace(0, len(key), workers + 1).astype(int)
+        with ThreadPoolExecutor(workers) as executor:
+            sums = sum(executor.map(lambda b: _block_sums(key[b[0]:b[1]], [v[b[0]:b[1]] for v in values], size),
+                                    zip(bounds[:-1], bounds[1:])))
+    else:
+        sums = _block_sums(key, values, size)
+
+    observed = np.flatnonzero(sums[0])
+    index = pd.MultiIndex.from_arrays([names[order][observed // n_years], first_year + observed % n_years],
+                                      names=['Country', 'Year'])
+    # the sums are exact in float64, they go back to the columns' own dtypes (as a groupby sum would)
+    return pd.DataFrame({column: sums[i + 1, observed].astype(df[column].dtype)
+                         for i, column in enumerate(FLOW_COLUMNS)}, index=index, columns=FLOW_COLUMNS)
+
+
+def normalized(flows, codes):
+    # sum_mig: the aggregate plus its min-max normalized columns (the bounds are refit on every snapshot,
+    # a new year can move them) and the ISO alpha-3 code of each country, which the choropleth locates by
+    sum_mig = flows.reset_index()
+    sum_mig['Country-code'] = sum_mig['Country'].astype(str).map(codes)
+    scaled = indexes.min_max_scale(flows.values.astype(float))
+    for i, column in enumerate(NORM_COLUMNS):
+        sum_mig[column] = scaled[:, i]
+    return sum_mig
+
+
+def _key_index(frame, keys):
+    # categorical keys go in as they are (no per-row string conversion), levels are matched by value
+    return pd.MultiIndex.from_arrays([frame[k].astype(np.int64) if frame[k].dtype.kind in 'iu' else frame[k].values
+                                      for k in keys])
+
+
+def _same_values(before, after):
+    # a categorical column is compared through its codes, the old ones translated to the new categories (-1,
+    # missing, stays -1)
+    before = before.values
+    if isinstance(before, pd.Categorical) and isinstance(after, pd.Categorical):
+        translate = np.append(after.categories.get_indexer(before.categories), -1)
+        return np.array_equal(translate[before.codes], after.codes)
+    before, after = np.asarray(before, dtype=object), np.asarray(after, dtype=object)
+    return bool(((before == after) | (pd.isna(before) & pd.isna(after))).all())
+
+
+def added_rows(old, new, keys):
+    # the rows of `new` whose key is not in `old`; None when a row of `old` was changed or removed
+    old_keys, new_keys = _key_index(old, keys), _key_index(new, keys)
+    if not (old_keys.is_unique and new_keys.is_unique):
+        return None
+
+    positions = new_keys.get_indexer(old_keys)
+    if (positions < 0).any():
+        return None
+
+    columns = [c for c in old.columns if c not in keys]
+    if any(c not in new.columns for c in columns):
+        return None
+    numeric = [c for c in columns if old[c].dtype.kind in 'iuf']
+    before = old[numeric].values.astype(float)
+    after = new[numeric].values[positions].astype(float)
+    if not np.array_equal(before, after, equal_nan=True):
+        return None
+    # the string columns too (the ISO codes locate the countries), compared by value
+    for column in columns:
+        if column not in numeric and not _same_values(old[column], new[column].values[positions]):
+            return None
+
+    added = np.ones(len(new), dtype=bool)
+    added[positions] = False
+    return new[added]
+
+
+def positions(codes, flow_tensor):
+    # (longitude, latitude) of every destination and origin of the tensor from the country codes (see
+    # validation.country_codes), NaN for a country without a centroid
+    centroids = data.load_centroids()
+
+    def lonlat(names):
+        unknown = (np.nan, np.nan)
+        return np.array([centroids.get(codes.get(str(name)), unknown) for name in names], dtype=float).reshape(-1, 2)
+
+    return lonlat(flow_tensor.destinations), lonlat(flow_tensor.origins)
+
+
+def country_regions(codes):
+    # country name -> region, from the country codes (empty without a regions file)
+    regions = data.load_regions()
+    return {name: regions[code] for name, code in codes.items() if code in regions}
+
+
+######################################################Snapshot##########################################################
+# Everything the callbacks read, derived from one version of the two workbooks. A snapshot is never modified:
+# a refresh builds the next one beside it and swaps the reference, so a callback that reads `store.current`
+# once sees consistent data even while a refresh lands.
+
+class Snapshot:
+
+    # what a snapshot derives from the two workbooks, i.e. what the warm cache stores (see warmcache.py)
+    DERIVED = ['flows', 'sum_mig', 'flow_tensor', 'indicator_cube', 'flow_cube', 'indicator_stats',
+               'destination_lonlat', 'origin_lonlat', 'corridors']
+
+    def __init__(self, df, df_ind, flows, flow_tensor, indicator_cube, flow_cube, version, pool=None):
+        self.df = df
+        self.df_ind = df_ind
+        self.flows = flows
+        # country name -> ISO alpha-3 code, what the choropleth, the corridor map and the regions locate by
+        codes = validation.country_codes(df, df_ind)
+        self.sum_mig = normalized(flows, codes)
+        self.flow_tensor = flow_tensor
+        self.indicator_cube = indicator_cube
+        self.flow_cube = flow_cube
+        # the indicators' per year statistics: global averages, percentile bands, country ranks, region means
+        self.indicator_stats = indexes.StatisticsCube(indicator_cube, regions=country_regions(codes))
+        self.version = version
+
+        # the corridor map: positions of the tensor's countries, and the corridors ranked per year (those with
+        # both ends on the map)
+        self.destination_lonlat, self.origin_lonlat = positions(codes, flow_tensor)
+        drawable = np.isfinite(self.destination_lonlat[flow_tensor.entry_destinations, 0]) & \
+            np.isfinite(self.origin_lonlat[flow_tensor.indices, 0])
+        self.corridors = indexes.CorridorIndex(flow_tensor, 'Inflow', keep=drawable)
+
+        self._finish(pool)
+
+    def _finish(self, pool):
+        self.pool = pool
+
+        # dropdown options (in workbook order), slider bounds and the (country, year) grid the memo accepts
+        self.countries = list(self.df_ind['Country'].astype(str).unique())
+        self.years = sorted(int(year) for year in self.df_ind['Year'].unique())
+        self.grid = {(country, year) for country in self.countries for year in self.years}
+
+        # one animated choropleth per migration variable, encoded on first use (in the build pool, if any)
+        self.choropleth = serving.EncodedCache(functools.partial(figures.choropleth_figure, self.sum_mig), pool)
+
+    def derived(self):
+        return {name: getattr(self, name) for name in self.DERIVED}
+
+    @classmethod
+    def restore(cls, df, df_ind, derived, version, pool=None):
+        # a snapshot from the workbooks and what derived() returned for them, nothing is recomputed
+        snapshot = cls.__new__(cls)
+        snapshot.df = df
+        snapshot.df_ind = df_ind
+        snapshot.version = version
+        for name in cls.DERIVED:
+            setattr(snapshot, name, derived[name])
+        snapshot._finish(pool)
+        return snapshot
+
+    @classmethod
+    def build(cls, df, df_ind, version, pool=None):
+        flows = aggregate_flows(df)
+        return cls(df, df_ind, flows,
+                   # the bilateral rows behind the top origins bars and the text boxes
+                   flow_tensor=indexes.FlowTensor(df),
+                   # df_ind as dense country x year x column arrays: the charted indicators (with their global
+                   # annual averages) and the flows for the line chart
+                   indicator_cube=indexes.IndicatorCube(df_ind, [column for column, _, _, _ in figures.INDICATORS],
+                                                        averages=True),
+                   flow_cube=indexes.IndicatorCube(df_ind, ['Inflow', 'Outflow']),
+                   version=version,
+                   pool=pool)
+
+    def extended(self, df, df_ind, version):
+        # the next snapshot when the workbooks only gained rows: only the (country, year) groups with new rows
+        # are aggregated again (the flow tensor is rebuilt, one sort of the rows). Returns self when nothing was added, None when existing rows
+        # changed (the caller then does a full build).
+        new_rows = added_rows(self.df, df, MIGRATION_KEYS)
+        new_ind_rows = added_rows(self.df_ind, df_ind, INDICATOR_KEYS)
+        if new_rows is None or new_ind_rows is None:
+            return None
+        if new_rows.empty and new_ind_rows.empty:
+            return self
+
+        flows = self.flows
+        flow_tensor = self.flow_tensor
+        if not new_rows.empty:
+            flows = pd.concat([flows, aggregate_flows(new_rows)]).groupby(level=[0, 1]).sum()
+            flow_tensor = indexes.FlowTensor(df)
+
+        indicator_cube = self.indicator_cube
+        flow_cube = self.flow_cube
+        if not new_ind_rows.empty:
+            indicator_cube = indicator_cube.extended(new_ind_rows, df_ind)
+            flow_cube = flow_cube.extended(new_ind_rows, df_ind)
+
+        return Snapshot(df, df_ind, flows, flow_tensor, indicator_cube, flow_cube, version, self.pool)
+
+
+######################################################Refresh###########################################################
+
+class SnapshotStore:
+
+    def __init__(self, pool=None, warm_cache=None):
+        self.pool = pool
+        self.warm_cache = warm_cache
+        # serializes refreshes; the callbacks never take it, they only read `current`
+        self.lock = threading.Lock()
+        # called as listener(old, new) after every swap
+        self.listeners = []
+
+        self.stamps = data.source_stamps()
+        version = data.data_version()
+        df, df_ind, self.report = self._load(version)
+
+        # with a warm cache (see warmcache.py) a start reads what an earlier one built for the same data and code;
+        # the first start of a version builds it and writes it for the next ones
+        self.current = warm_cache.load(df, df_ind, version, pool) if warm_cache is not None else None
+        if self.current is None:
+            self.current = self._build(df, df_ind, version)
+
+    def _load(self, version):
+        # the workbooks, validated and normalized once here so nothing downstream checks them again, and the
+        # report of what the validation found (served on /_data-report)
+        df, df_ind, report = validation.validate(*data.load_data())
+        return df, df_ind, dict(report, version=version)
+
+    def _build(self, df, df_ind, version):
+        snapshot = Snapshot.build(df, df_ind, version, self.pool)
+        if self.warm_cache is not None:
+            try:
+                self.warm_cache.save(snapshot)
+            except OSError:
+                # e.g. a read only deployment, it only stays cold
+                traceback.print_exc()
+        return snapshot
+
+    def refresh(self, force=False):
+        # reload the workbooks if they changed and swap the next snapshot in; returns a report
+        with self.lock:
+            start = time.time()
+            old = self.current
+            stamps = data.source_stamps()
+            if stamps == self.stamps and not force:
+                return {'status': 'unchanged', 'version': old.version}
+
+            version = data.data_version()
+            snapshot = old
+            status = 'unchanged'
+            if version != old.version:
+                df, df_ind, report = self._load(version)
+                snapshot = old.extended(df, df_ind, version)
+                status = 'incremental'
+                if snapshot is old:
+                    # the workbooks changed in a way the comparison of the rows does not see, never keep the old
+                    # snapshot under a new version
+                    snapshot = None
+                if snapshot is None and self.warm_cache is not None:
+                    snapshot = self.warm_cache.load(df, df_ind, version, self.pool)
+                    status = 'warm cache'
+                if snapshot is None:
+                    snapshot = self._build(df, df_ind, version)
+                    status = 'full'
+
+            self.stamps = stamps
+            if snapshot is old:
+                return {'status': status, 'version': old.version}
+
+            # the swap is one reference assignment, atomic for the threads serving callbacks
+            self.current = snapshot
+            self.report = report
+            for listener in self.listeners:
+                listener(old, snapshot)
+
+            return {'status': status,
+                    'version': snapshot.version,
+                    'previous_version': old.version,
+                    'rows': len(snapshot.df),
+                    'added_rows': len(snapshot.df) - len(old.df),
+                    'indicator_rows': len(snapshot.df_ind),
+                    'added_indicator_rows': len(snapshot.df_ind) - len(old.df_ind),
+                    'years': [snapshot.years[0], snapshot.years[-1]],
+                    'seconds': round(time.time() - start, 3)}
+
+    def watch(self, interval):
+        # poll the workbooks' mtime/size every `interval` seconds in a daemon thread (one per worker process)
+
+        def poll():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.refresh()
+                except Exception:
+                    # e.g. a workbook caught half copied; the stamps are not updated, so the next poll retries
+                    traceback.print_exc()
+
+        thread = threading.Thread(target=poll, name='migration-refresh', daemon=True)
+        thread.start()
+        return thread
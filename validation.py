@@ -0,0 +1,130 @@
+import json
+import re
+
+import numpy as np
+import pandas as pd
+
+import data
+
+
+
+######################################################Validation########################################################
+# Both workbooks are checked and normalized once, as they are loaded, so the callbacks can take the data as clean:
+# rows without a key are dropped, a repeated key keeps its first row, missing flows count as 0 (the sums and the
+# net direction of the text boxes are never NaN), and every country name gets the ISO alpha-3 code the workbooks pair
+# it with, which the choropleth locates countries by. Each step is a few vectorized passes over the columns; what
+# was found and changed is returned as a report (served on /_data-report, printed by `python validation.py`).
+
+MIGRATION_KEYS = ['Country', 'Country of origin', 'Year']
+INDICATOR_KEYS = ['Country', 'Year']
+FLOW_COLUMNS = ['Inflow', 'Outflow', 'Net-Migration']
+
+# the (name column, code column) pairs of the workbooks
+CODE_COLUMNS = [('Country', 'Country-code'), ('Country of origin', 'Origin')]
+
+ISO3 = re.compile('^[A-Z]{3}$')
+
+# rows listed per finding in the report (the counts are always complete)
+SAMPLE_ROWS = 5
+
+
+def _sample(frame, mask, columns):
+    rows = frame.loc[mask, columns].head(SAMPLE_ROWS)
+    return [{column: (value.item() if isinstance(value, np.generic) else value) for column, value in row.items()}
+            for row in rows.to_dict('records')]
+
+
+def _drop_rows(frame, drop):
+    # copying only when there is something to drop (the cached frames are memory-mapped)
+    if not drop.any():
+        return frame
+    return frame.loc[~drop].reset_index(drop=True)
+
+
+def _clean_keys(frame, keys):
+    # rows without a key are dropped, then every key but the first of its rows; returns (frame, report)
+    missing = frame[keys].isna().any(axis=1).values
+    frame = _drop_rows(frame, missing)
+    duplicated = frame.duplicated(keys).values
+    report = {'missing_keys': int(missing.sum()),
+              'duplicates': int(duplicated.sum()),
+              'duplicate_rows': _sample(frame, duplicated, keys)}
+    return _drop_rows(frame, duplicated), report
+
+
+def _pairs(names, codes):
+    # the distinct (name, code) pairs of two columns in order of appearance, rows missing either left out; through the
+    # factorized columns, so only the pairs are turned into strings
+    name_codes, name_values = pd.factorize(names)
+    code_codes, code_values = pd.factorize(codes)
+    present = (name_codes >= 0) & (code_codes >= 0)
+    pairs = pd.unique(name_codes[present].astype(np.int64) * len(code_values) + code_codes[present])
+    return pd.DataFrame({'name': np.asarray(name_values, dtype=object)[pairs // len(code_values)].astype(str),
+                         'code': np.asarray(code_values, dtype=object)[pairs % len(code_values)].astype(str)})
+
+
+def _code_pairs(df, df_ind):
+    # every distinct (name, code) pair of the workbooks, in workbook order
+    return pd.concat([_pairs(frame[name], frame[code])
+                      for frame, columns in ((df, CODE_COLUMNS), (df_ind, CODE_COLUMNS[:1]))
+                      for name, code in columns if code in frame]).drop_duplicates()
+
+
+def _codes(pairs):
+    valid = pairs[pairs['code'].str.match(ISO3.pattern)]
+    return dict(valid.drop_duplicates('name').values)
+
+
+def country_codes(df, df_ind):
+    # country name -> ISO alpha-3 code, from the (name, code) pairs of the workbooks; a name paired with several
+    # codes keeps the first one and a malformed code is no code
+    return _codes(_code_pairs(df, df_ind))
+
+
+def _code_report(df, df_ind, pairs, codes):
+    names = set()
+    for frame, columns in ((df, ['Country', 'Country of origin']), (df_ind, ['Country'])):
+        for column in columns:
+            names.update(str(name) for name in frame[column].unique())
+    by_name = pairs.groupby('name')['code'].nunique()
+    by_code = pairs.groupby('code')['name'].nunique()
+    return {'countries': len(names),
+            'codes': len(codes),
+            'without_code': sorted(names - set(codes)),
+            'invalid_codes': sorted(set(pairs['code'][~pairs['code'].str.match(ISO3.pattern)])),
+            'names_with_several_codes': sorted(by_name.index[by_name > 1]),
+            'codes_with_several_names': sorted(by_code.index[by_code > 1])}
+
+
+def validate(df, df_ind):
+    # the validated (df, df_ind) and the report of what was found
+    df, migration = _clean_keys(df, MIGRATION_KEYS)
+    df_ind, indicators = _clean_keys(df_ind, INDICATOR_KEYS)
+
+    flows = {}
+    for column in FLOW_COLUMNS:
+        values = df[column].values
+        missing = np.isnan(values) if values.dtype.kind == 'f' else np.zeros(len(values), dtype=bool)
+        flows[column] = {'missing': int(missing.sum())}
+        if missing.any():
+            df = df.assign(**{column: np.where(missing, 0, values)})
+    for column in ('Inflow', 'Outflow'):
+        negative = df[column].values < 0
+        flows[column].update(negative=int(negative.sum()),
+                             negative_rows=_sample(df, negative, MIGRATION_KEYS + [column]))
+    mismatch = df['Net-Migration'].values != df['Inflow'].values - df['Outflow'].values
+    flows['Net-Migration'].update(not_inflow_minus_outflow=int(mismatch.sum()))
+
+    migration.update(rows=len(df), flows=flows)
+    indicators.update(rows=len(df_ind))
+    pairs = _code_pairs(df, df_ind)
+    report = {'migration': migration,
+              'indicators': indicators,
+              'countries': _code_report(df, df_ind, pairs, _codes(pairs))}
+    return df, df_ind, report
+
+
+if __name__ == '__main__':
+    # the report of the workbooks as they are now
+    _, _, report = validate(*data.load_data())
+    print(json.dumps(report, indent=1))
@@ -0,0 +1,202 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import pickle
+import shutil
+import sys
+import time
+from importlib import metadata
+
+import data
+import figures
+import snapshot
+
+
+
+######################################################Warm cache########################################################
+# What a worker derives from one version of the workbooks, kept on disk across restarts and deploys: the snapshot's
+# aggregates and indexes, the figure templates and the encoded choropleths. An entry is a directory named
+# <data version>-<inputs version>-<code version>: the inputs version hashes the other files a snapshot reads (the
+# centroids, the regions file), the code version the modules that shape what is stored and the versions of the
+# libraries that pickle it, so a deploy changing any of them never reads an older entry. The arrays are pickled
+# out of band (protocol 5) into one file that is memory-mapped on load: nothing is copied or recomputed, and the
+# processes of a host share the pages.
+
+WARM_FORMAT = 1
+
+# the modules whose code decides what an entry holds
+CODE_FILES = ['data.py', 'validation.py', 'indexes.py', 'snapshot.py', 'figures.py', 'serving.py', 'warmcache.py']
+LIBRARIES = ['numpy', 'pandas', 'plotly', 'dash']
+
+# buffers are aligned for any dtype in the arrays file
+ALIGNMENT = 64
+
+
+def code_version():
+    sha1 = hashlib.sha1(str(WARM_FORMAT).encode())
+    for name in CODE_FILES:
+        with open(os.path.join(data.BASE_DIR, name), 'rb') as f:
+            sha1.update(f.read())
+    for library in LIBRARIES:
+        sha1.update(metadata.version(library).encode())
+    sha1.update(sys.version.encode())
+    return sha1.hexdigest()[:12]
+
+
+def inputs_version():
+    # the files besides the workbooks that a snapshot derives from: the centroids of the corridor map and the
+    # regions file of the statistics cube (its path and content, none without MIGRATION_REGIONS_FILE)
+    sha1 = hashlib.sha1(data.file_hash(data.CENTROIDS_FILE).encode())
+    if data.REGIONS_FILE:
+        sha1.update(os.path.abspath(data.REGIONS_FILE).encode())
+        sha1.update(data.file_hash(data.REGIONS_FILE).encode())
+    return sha1.hexdigest()[:8]
+
+
+def _read_meta(entry_path):
+    try:
+        with open(os.path.join(entry_path, 'meta.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class WarmCache:
+
+    def __init__(self, path):
+        self.path = path
+        self.code_version = code_version()
+
+    def entry_name(self, version):
+        return '-'.join([version, inputs_version(), self.code_version])
+
+    def entry_path(self, version):
+        return os.path.join(self.path, self.entry_name(version))
+
+    def load(self, df, df_ind, version, pool=None):
+        # the snapshot of `version` (with its templates loaded into figures and its choropleths encoded), None
+        # without a valid entry
+        entry_path = self.entry_path(version)
+        meta = _read_meta(entry_path)
+        if meta is None or meta.get('format') != WARM_FORMAT:
+            return None
+
+        with open(os.path.join(entry_path, 'arrays.bin'), 'rb') as f:
+            arrays = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)) if meta['buffers'] else b''
+        with open(os.path.join(entry_path, 'objects.pkl'), 'rb') as f:
+            objects = pickle.load(f, buffers=[arrays[offset:offset + length] for offset, length in meta['buffers']])
+
+        snap = snapshot.Snapshot.restore(df, df_ind, objects['derived'], version, pool)
+        figures.load_templates(objects['templates'])
+        snap.choropleth.encoded.update(objects['choropleths'])
+        return snap
+
+    def save(self, snap, choropleth_keys=snapshot.NORM_COLUMNS):
+        # write the entry of a snapshot, building its choropleths and the templates first
+        snap.choropleth.warm(choropleth_keys)
+        objects = {'derived': snap.derived(),
+                   'templates': figures.build_templates(),
+                   'choropleths': {key: snap.choropleth.get(key) for key in choropleth_keys}}
+
+        entry_path = self.entry_path(snap.version)
+        tmp_path = entry_path + '.tmp-' + str(os.getpid())
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        buffers = []
+        with open(os.path.join(tmp_path, 'objects.pkl'), 'wb') as f:
+            pickle.dump(objects, f, protocol=5, buffer_callback=buffers.append)
+
+        offsets = []
+        with open(os.path.join(tmp_path, 'arrays.bin'), 'wb') as f:
+            for buffer in buffers:
+                raw = buffer.raw()
+                f.write(b'\0' * (-f.tell() % ALIGNMENT))
+                offsets.append([f.tell(), raw.nbytes])
+                f.write(raw)
+
+        meta = {'format': WARM_FORMAT,
+                'data_version': snap.version,
+                'inputs_version': inputs_version(),
+                'code_version': self.code_version,
+                'created': time.time(),
+                'buffers': offsets,
+                'choropleths': list(choropleth_keys)}
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+        # swap the finished directory in, like the columnar cache
+        old_path = entry_path + '.old-' + str(os.getpid())
+        if os.path.exists(entry_path):
+            os.rename(entry_path, old_path)
+        os.rename(tmp_path, entry_path)
+        shutil.rmtree(old_path, ignore_errors=True)
+        return meta
+
+    def entries(self):
+        # (name, meta or None, bytes) of every entry, newest first
+        if not os.path.isdir(self.path):
+            return []
+        entries = []
+        for name in os.listdir(self.path):
+            entry_path = os.path.join(self.path, name)
+            if os.path.isdir(entry_path):
+                size = sum(os.path.getsize(os.path.join(entry_path, f)) for f in os.listdir(entry_path))
+                entries.append((name, _read_meta(entry_path), size))
+        return sorted(entries, key=lambda entry: -(entry[1] or {}).get('created', 0))
+
+    def prune(self, keep_versions=(), keep=0):
+        # remove the entries of other code or inputs versions, unreadable ones and leftovers of interrupted writes; of
+        # the others, those of keep_versions stay and so do the `keep` newest; returns the names removed
+        removed = []
+        kept = 0
+        for name, meta, _ in self.entries():
+            current = meta is not None and meta.get('format') == WARM_FORMAT and \
+                name == self.entry_name(meta['data_version'])
+            if current and meta['data_version'] in keep_versions:
+                continue
+            if current and kept < keep:
+                kept += 1
+                continue
+            shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+            removed.append(name)
+        return removed
+
+
+def cache_from_env():
+    path = os.environ.get('MIGRATION_WARM_CACHE')
+    return WarmCache(path) if path else None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build, inspect or prune the warm cache (MIGRATION_WARM_CACHE)')
+    parser.add_argument('command', choices=['build', 'inspect', 'prune'])
+    parser.add_argument('--path', default=os.environ.get('MIGRATION_WARM_CACHE', os.path.join(data.CACHE_DIR, 'warm')))
+    parser.add_argument('--keep', type=int, default=0,
+                        help='prune: also keep this many of the newest entries for older data')
+    args = parser.parse_args()
+
+    cache = WarmCache(args.path)
+    if args.command == 'build':
+        # build from the workbooks, not from an entry
+        os.environ.pop('MIGRATION_WARM_CACHE', None)
+        import app
+        start = time.time()
+        meta = cache.save(app.snapshots.current)
+        print('built', cache.entry_path(meta['data_version']), '{:.1f}s'.format(time.time() - start))
+    elif args.command == 'inspect':
+        print('code version', cache.code_version)
+        for name, meta, size in cache.entries():
+            if meta is None:
+                print('{:<40} {:>10} bytes  (incomplete)'.format(name, size))
+            else:
+                print('{:<40} {:>10} bytes  {}  {} buffers, choropleths: {}{}'.format(
+                    name, size, time.strftime('%Y-%m-%d %H:%M', time.localtime(meta['created'])),
+                    len(meta['buffers']), ', '.join(meta['choropleths']),
+                    '' if name == cache.entry_name(meta['data_version']) else '  (other code or inputs version)'))
+    else:
+        current = data.data_version()
+        for name in cache.prune(keep_versions=[current], keep=args.keep):
+            print('removed', name)